@@ -1,5 +1,7 @@
 import os
 import sys
+import threading
+import time
 from pathlib import Path
 
 # ----------------------------
@@ -88,10 +90,20 @@ def run() -> int:
     # 在创建 QApplication 之前设置缩放策略
     apply_scale(scale_mode)
 
+    from PyQt5.QtCore import QTimer
     from PyQt5.QtWidgets import QApplication
     app = QApplication(sys.argv)
     app.setApplicationName("Smart Driving")
 
+    # ===== 后台预加载（与开机动画并行）：导入重型模块 / 加载权重 / 扫描音乐与录像 =====
+    from view.preload import Preloader, default_phases
+    t_start = time.perf_counter()
+    preload = Preloader(default_phases())
+    preload.start()
+    state = {"splash_s": None, "ui_started": False}
+    # 动画关闭后可能还要等预加载：这段时间没有可见窗口，不能让 Qt 自动退出
+    app.setQuitOnLastWindowClosed(False)
+
     # ===== 封装后续 UI 启动逻辑（与你原逻辑一致）:contentReference[oaicite:1]{index=1}=====
     def _start_ui():
         try:
@@ -127,23 +139,59 @@ def run() -> int:
         login.show()
         return 0
 
+    # ===== 开机动画与预加载都结束后才拉起 UI =====
+    def _maybe_start_ui():
+        if state["ui_started"]:
+            return
+        if not preload.done():
+            QTimer.singleShot(30, _maybe_start_ui)  # 动画已结束、预加载未完：稍等再查
+            return
+        state["ui_started"] = True
+        t_ui = time.perf_counter()
+        code = 1
+        try:
+            code = _start_ui()
+        except Exception as e:
+            print("[FATAL] 创建界面失败：", repr(e))
+        finally:
+            app.setQuitOnLastWindowClosed(True)
+        if code:
+            # 没有任何窗口可关：不主动退出的话事件循环会一直挂着
+            app.exit(code)
+            return
+        extra = []
+        if state["splash_s"] is not None:
+            extra.append(("splash", state["splash_s"]))
+        extra.append(("build UI", time.perf_counter() - t_ui))
+        extra.append(("total", time.perf_counter() - t_start))
+        print(preload.report(extra))
+        # 模型在后台继续加载/预热：全部就绪后打印 ModelManager 实测的加载/预热耗时；退出时再汇总一次
+        from view.preload import model_report
+        threading.Thread(target=lambda: print(model_report()), name="model-report", daemon=True).start()
+        from view.model_manager import get_model_manager
+        app.aboutToQuit.connect(lambda: print(get_model_manager().report()))
+
+    def _on_splash_done():
+        if state["splash_s"] is None:
+            state["splash_s"] = time.perf_counter() - t_start
+        _maybe_start_ui()
+
     # ===== 开机动画（OpenCV 解码，不用 QMediaPlayer）=====
     try:
         from view.splash_video import SplashVideoCV  # 见下说明：需新增该文件
         splash_path = str((ROOT / "view" / "splash.mp4").resolve())  # 绝对路径
         if os.path.exists(splash_path):
-            splash = SplashVideoCV(splash_path, next_callback=_start_ui)
+            splash = SplashVideoCV(splash_path, next_callback=_on_splash_done)
             splash.show()
 
-            # 保险：最长 15s 后一定进入 UI，避免坏帧阻塞
-            from PyQt5.QtCore import QTimer
+            # 保险：最长 15s 后一定结束动画，避免坏帧阻塞
             QTimer.singleShot(15000, getattr(splash, "_finish"))
         else:
-            print("[INFO] 未找到开机动画：", splash_path, "，直接进入 UI")
-            _start_ui()
+            print("[INFO] 未找到开机动画：", splash_path, "，预加载完成后直接进入 UI")
+            _maybe_start_ui()
     except Exception as e:
-        print("[WARN] 开机动画异常：", repr(e), "，直接进入 UI")
-        _start_ui()
+        print("[WARN] 开机动画异常：", repr(e), "，预加载完成后直接进入 UI")
+        _maybe_start_ui()
 
     return app.exec_()
 
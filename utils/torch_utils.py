@@ -1,6 +1,7 @@
 # YOLOR PyTorch utils
 
 import datetime
+import hashlib
 import logging
 import math
 import os
@@ -371,4 +372,99 @@ class TracedModel(nn.Module):
     def forward(self, x, augment=False, profile=False):
         out = self.model(x)
         out = self.detect_layer(out)
-        return out
\ No newline at end of file
+        return out
+
+def file_hash(path, n=16):
+    # sha1 of a file's contents (first n hex chars), streamed
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()[:n]
+
+
+class TracedModelCache(nn.Module):
+    # TracedModel for several square input sizes. The part before the detect layer is traced once per size and saved as
+    # <cache_dir>/<weights hash>-torch<version>-<device type>-<dtype>-<size>.pt, so later runs only torch.jit.load it.
+    # forward() picks the trace matching the input shape (eager model otherwise), so callers switch resolution at
+    # runtime just by feeding another letterboxed size; nothing is re-traced and the shared eager model is untouched.
+    # Traces are square (size x size): callers must letterbox with auto=False, which costs more than a minimal
+    # rectangle for non-square frames (320x320 vs 320x192 for 16:9). cache_dir must be writable; if saving fails
+    # the traces are still used for this run.
+
+    def __init__(self, model, weights, device, img_sizes=(256, 320), cache_dir='traced_cache'):
+        super(TracedModelCache, self).__init__()
+        self.stride = model.stride
+        self.names = model.names
+        self.model = model.eval()
+        self.detect_layer = model.model[-1]
+        self.cache_dir = Path(cache_dir)
+        dtype = next(model.parameters()).dtype
+        self.prefix = '%s-torch%s-%s-%s' % (file_hash(weights), torch.__version__.split('+')[0], device.type,
+                                            str(dtype).replace('torch.', ''))
+        self.traced = {}  # size -> ScriptModule, shapes (1,3,size,size)
+        for s in img_sizes:
+            self.traced[int(s)] = self._load_or_trace(int(s), device, dtype)
+
+    def artifact(self, img_size):
+        return self.cache_dir / f'{self.prefix}-{img_size}.pt'
+
+    def _load_or_trace(self, img_size, device, dtype):
+        f = self.artifact(img_size)
+        if f.exists():
+            try:
+                return torch.jit.load(str(f), map_location=device)
+            except Exception as e:  # stale/corrupt artifact: re-trace below
+                logger.info(f'Ignoring traced cache {f}: {e}')
+        t = time.time()
+        self.model.traced = True  # forward_once stops before the detect layer
+        try:
+            with torch.no_grad():
+                ts = torch.jit.trace(self.model, torch.zeros(1, 3, img_size, img_size, device=device, dtype=dtype),
+                                     strict=False)
+        finally:
+            self.model.traced = False
+        logger.info(f'Traced {img_size}x{img_size} in {time.time() - t:.1f}s')
+        tmp = f.with_suffix(f'.{os.getpid()}.tmp')
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            ts.save(str(tmp))
+            os.replace(tmp, f)  # atomic: concurrent processes never see half-written artifacts
+        except OSError as e:  # read-only location: keep the in-memory trace, re-trace next run
+            logger.info(f'Could not cache trace {f}: {e}')
+        return ts
+
+    def forward(self, x, augment=False, profile=False):
+        ts = self.traced.get(x.shape[-1]) if x.shape[0] == 1 and x.shape[-1] == x.shape[-2] else None
+        if ts is None or augment:
+            return self.model(x, augment=augment, profile=profile)
+        return self.detect_layer(list(ts(x)))
+
+
+def benchmark_traced(model, weights, img_sizes=(256, 320), frame_shape=(720, 1280), n=50, cache_dir='traced_cache'):
+    # Per imgsz: eager on the minimal rectangle letterbox (what detect() uses without a trace), eager on the square
+    # input, and the square trace. traced vs rect is the end-to-end trade-off of enabling tracing for this frame shape.
+    p = next(model.parameters())
+    model.eval()
+    cache = TracedModelCache(model, weights, p.device, img_sizes, cache_dir)
+    h, w = frame_shape
+    print('%8s%12s%12s%12s%12s' % ('imgsz', 'rect', 'eager ms', 'traced ms', 'vs rect'))
+    res = {}
+    for s in img_sizes:
+        r = s / max(h, w)
+        rect = (math.ceil(h * r / 32) * 32, math.ceil(w * r / 32) * 32)
+        t = {}
+        with torch.no_grad():
+            for name, fn, shape in (('rect', model, rect), ('square', model, (s, s)), ('traced', cache, (s, s))):
+                x = torch.zeros(1, 3, *shape, device=p.device, dtype=p.dtype)
+                for _ in range(5):  # warm-up, includes the JIT profiling runs
+                    fn(x)
+                t0 = time_synchronized()
+                for _ in range(n):
+                    fn(x)
+                t[name] = (time_synchronized() - t0) * 1E3 / n
+        res[s] = t
+        print('%8g%12s%12.1f%12.1f%11.2fx' % (s, '%dx%d' % rect[::-1], t['rect'], t['traced'],
+                                                t['rect'] / t['traced']))
+        print('%8s%12s%12.1f%24s' % ('', 'square', t['square'], ''))
+    return res
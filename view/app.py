@@ -47,8 +47,9 @@ from PyQt5.QtMultimedia import (
 from view.functions import (
     FunctionBar, FunctionManager, VideoPage, ImagePage, UserPage, Video1DetectPage, VideoBrowserPage
 )
-from view.driving_detect import driving_detect
-from view.functions import resource_path
+from view.driving_detect import driving_detect, driver_detector
+from view.model_manager import get_model_manager
+from view.functions import resource_path, get_recording_index, get_capture_index
 
 def get_weather_kl():
     # 吉隆坡的经纬度：3.1390, 101.6869
@@ -108,9 +109,11 @@ class CameraPage(QWidget):
         self.timer = QTimer(self)          # 刷帧计时器（~30fps）
         self.timer.timeout.connect(self.update_frame)
 
-        self.detector = None               # driving_detect 实例
+        self.detector = None               # driving_detect 实例（模型就绪后才创建）
+        self._detector_spec = driver_detector()  # 共享模型规格：用于查询/触发后台加载
         self.detect_enabled = True         # 是否启用检测
         self.last_bgr_shown = None         # 上次显示的 BGR 帧（含框）
+        self._last_dets = None             # 该帧的检测元数据：(时间戳, [(cls, cls_id, conf, box)], 是否报警)
 
         # ====== 自动保存 & 倒计时 ======
         self.autosave_interval = 30        # 秒
@@ -125,6 +128,9 @@ class CameraPage(QWidget):
         self.segment_start_ts = None       # 当前片段开始时间戳
         self.target_fps = 30.0             # 目标帧率（fallback）
         self.frame_size = None             # (w, h) for VideoWriter
+        self.segment_path = None           # 当前片段文件路径
+        self._segment_frames = 0           # 当前片段已写入帧数
+        self._segment_events = 0           # 当前片段内触发的报警次数
 
         # 图片保存目录（用于手动截图）
         self.capture_dir = Path(resource_path('image', 'captures'))
@@ -166,11 +172,7 @@ class CameraPage(QWidget):
             return
 
         if self.detector is None:
-            try:
-                self.detector = driving_detect()
-            except Exception as e:
-                print("Detector init failed:", e)
-                self.detector = None
+            self._ensure_detector()
 
         # 读取摄像头 FPS；拿不到则回退 30
         try:
@@ -189,6 +191,21 @@ class CameraPage(QWidget):
 
         self.segment_start_ts = time.time()
 
+    def _ensure_detector(self):
+        """
+        检测模型由 ModelManager 在后台加载 + 预热：未就绪时只触发加载并跳过本帧检测，
+        不在 GUI 线程里等权重；就绪后再构造 driving_detect（直接复用共享模型）
+        """
+        mgr = get_model_manager()
+        if not mgr.ready(self._detector_spec):
+            mgr.prefetch(self._detector_spec)
+            return
+        try:
+            self.detector = driving_detect(timeout=0)
+        except Exception as e:
+            print("Detector init failed:", e)
+            self.detector = None
+
     def stop_camera(self):
         """停止摄像头与计时器"""
         if self.timer.isActive():
@@ -223,17 +240,29 @@ class CameraPage(QWidget):
         fourcc = cv2.VideoWriter_fourcc(*'mp4v')  # .mp4
         self.writer = cv2.VideoWriter(str(path), fourcc, self.target_fps, self.frame_size)
         self.segment_start_ts = time.time()
+        self.segment_path = path
+        self._segment_frames = 0
+        self._segment_events = 0
         if not self.writer or not self.writer.isOpened():
             print("VideoWriter 打开失败 / failed to open:", path)
 
     def _close_segment(self):
-        """关闭当前视频片段"""
+        """关闭当前视频片段，并把片段信息写入录像索引"""
         if self.writer is not None:
             try:
                 self.writer.release()
             except Exception:
                 pass
             self.writer = None
+            if self.segment_path is not None and self._segment_frames > 0:
+                try:
+                    get_recording_index().record(
+                        str(self.segment_path), fps=self.target_fps, size=self.frame_size,
+                        frames=self._segment_frames, events=self._segment_events
+                    )
+                except Exception as e:
+                    print("录像索引写入失败:", e)
+            self.segment_path = None
 
     # ====== 核心帧循环 ======
     def update_frame(self):
@@ -246,8 +275,11 @@ class CameraPage(QWidget):
 
         draw_bgr = frame_bgr.copy()
         detected_labels = None  # 用于异常判定
+        dets = None             # 截图时写入索引的检测元数据（None=本帧未检测）
 
         # —— 检测与画框 ——
+        if self.detect_enabled and self.detector is None:
+            self._ensure_detector()
         if self.detect_enabled and self.detector is not None:
             try:
                 labels, boxes = self.detector.detect(frame_bgr)
@@ -255,6 +287,7 @@ class CameraPage(QWidget):
                 labels, boxes = None, None
 
             detected_labels = labels
+            dets = self._to_detections(labels, boxes)
 
             if boxes:
                 h, w = draw_bgr.shape[:2]
@@ -270,9 +303,9 @@ class CameraPage(QWidget):
                                 cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2, cv2.LINE_AA)
 
         # —— 异常行为 → 报警（带冷却）——
-        if self._alarm_enabled and detected_labels:
-            if self._any_abnormal(detected_labels):
-                self._trigger_alarm()
+        abnormal = bool(detected_labels) and self._any_abnormal(detected_labels)
+        if self._alarm_enabled and abnormal:
+            self._trigger_alarm()
 
         # —— 写入视频（30s切片）——
         if self.writer is None:
@@ -285,6 +318,7 @@ class CameraPage(QWidget):
         if self.writer is not None and self.writer.isOpened():
             try:
                 self.writer.write(draw_bgr)
+                self._segment_frames += 1
             except Exception as e:
                 print("写入视频帧失败:", e)
 
@@ -344,6 +378,7 @@ class CameraPage(QWidget):
             print("绘制叠加层失败：", e)
 
         self.last_bgr_shown = draw_bgr
+        self._last_dets = (time.time(), dets, abnormal)
 
     # ====== 截图相关 ======
     def take_photo(self):
@@ -355,8 +390,11 @@ class CameraPage(QWidget):
         name = f"auto_{ts}.jpg" if auto else f"photo_{ts}.jpg"
         path = self.capture_dir / name
 
+        meta = None  # 只有保存的是已显示帧时，检测元数据才与画面对应
+        dir_before = get_capture_index().dir_mtime(str(self.capture_dir))
         if self.last_bgr_shown is not None:
             ok = cv2.imwrite(str(path), self.last_bgr_shown)
+            meta = self._last_dets
         else:
             ok = False
             if self.cap:
@@ -365,6 +403,10 @@ class CameraPage(QWidget):
                     ok = cv2.imwrite(str(path), frame)
 
         if ok:
+            det_ts, dets, alarm = meta if meta is not None else (None, None, None)
+            get_capture_index().add(str(path), source="camera_auto" if auto else "camera",
+                                    detections=dets, alarm=alarm, det_ts=det_ts,
+                                    dir_mtime_before=dir_before)
             print(("自动保存" if auto else "已保存截图"), "->", path)
             if not auto:  # 仅手动截图显示提示；如需自动也显示，去掉此判断
                 self._shot_msg_until = time.time() + self._shot_msg_ms / 1000.0
@@ -383,6 +425,9 @@ class CameraPage(QWidget):
         """关闭页面时释放资源"""
         try:
             self.stop_camera()
+            if self.detector is not None:  # 归还共享模型，闲置后可按内存预算卸载
+                self.detector.release()
+                self.detector = None
         finally:
             event.accept()
 
@@ -398,6 +443,28 @@ class CameraPage(QWidget):
         cls = s[:pos] if pos > 0 else s
         return cls.lower()
 
+    def _to_detections(self, labels, boxes):
+        """
+        detect() 的 ("ClassName:0.87", [x1, y1, x2, y2]) 列表 → 索引用的 [(cls, cls_id, conf, box)]
+        cls_id 按模型 names 反查；无检测时返回 []
+        """
+        if not labels:
+            return []
+        model = getattr(self.detector, "model", None)
+        names = getattr(getattr(model, "module", model), "names", None) or []
+        ids = {str(n).lower(): i for i, n in enumerate(names)}
+        out = []
+        for lab, box in zip(labels, boxes or []):
+            s = str(lab).strip()
+            pos = s.rfind(":")
+            cls, conf = (s[:pos], s[pos + 1:]) if pos > 0 else (s, "1")
+            try:
+                conf = float(conf)
+            except ValueError:
+                conf = 1.0
+            out.append((cls, ids.get(cls.lower()), conf, tuple(box)))
+        return out
+
     def _is_abnormal_label(self, label_with_conf: str) -> bool:
         cls = self._parse_class_name(label_with_conf)
         if not cls:
@@ -417,6 +484,7 @@ class CameraPage(QWidget):
         if time.time() - self._last_alarm_ts < self.alarm_cooldown_secs:
             return
         self._last_alarm_ts = time.time()
+        self._segment_events += 1
         self._alarm.play()
 
 
@@ -685,6 +753,36 @@ class NavigationPage(QWidget):
                 QListWidgetItem(f"{i}. {t}（约 {st['distance']:.0f} 米，{st['duration'] / 60:.1f} 分钟）"))
 
 
+# ========== 音乐目录扫描（可在启动预加载阶段提前执行） ==========
+MUSIC_EXTS = (".mp3", ".m4a", ".wav", ".flac", ".ogg")
+_MUSIC_DURATIONS = {}  # (完整路径, mtime_ns) -> 时长(ms) 或 None
+
+
+def scan_music_folder(music_dir):
+    """返回 [(文件名, 完整路径, 时长ms或None)]；时长按文件修改时间缓存，重复扫描不再解析"""
+    tracks = []
+    for fname in sorted(os.listdir(music_dir)):
+        if not fname.lower().endswith(MUSIC_EXTS):
+            continue
+        full_path = os.path.abspath(os.path.join(music_dir, fname))
+        try:
+            key = (full_path, os.stat(full_path).st_mtime_ns)
+        except OSError:
+            continue
+        if key not in _MUSIC_DURATIONS:
+            duration_ms = None
+            if MutagenFile is not None:
+                try:
+                    audio = MutagenFile(full_path)
+                    if audio and audio.info:
+                        duration_ms = int(audio.info.length * 1000)
+                except Exception as e:
+                    print("读取时长失败:", e)
+            _MUSIC_DURATIONS[key] = duration_ms
+        tracks.append((fname, full_path, _MUSIC_DURATIONS[key]))
+    return tracks
+
+
 # ========== 音乐页面 ==========
 class MusicPage(QWidget):
     """
@@ -836,25 +934,12 @@ class MusicPage(QWidget):
 
     # ====== 加载音乐文件 ======
     def load_music_from_folder(self):
-        exts = (".mp3", ".m4a", ".wav", ".flac", ".ogg")
         self.list_widget.clear()
         self.track_paths.clear()
         self.track_durations.clear()
 
-        for fname in sorted(os.listdir(self.music_dir)):
-            if not fname.lower().endswith(exts):
-                continue
-            full_path = os.path.abspath(os.path.join(self.music_dir, fname))
+        for fname, full_path, duration_ms in scan_music_folder(self.music_dir):
             self.track_paths.append(full_path)
-
-            duration_ms = None
-            if MutagenFile is not None:
-                try:
-                    audio = MutagenFile(full_path)
-                    if audio and audio.info:
-                        duration_ms = int(audio.info.length * 1000)
-                except Exception as e:
-                    print("读取时长失败:", e)
             self.track_durations.append(duration_ms)
 
             item = QListWidgetItem(fname)
@@ -1737,6 +1822,11 @@ class MainWindow(QMainWindow):
         self.page_cam.stop_camera()
         self.page_video1.stop()
         self.page_video2.stop()
+        self.video_browser.thumbs.shutdown()
+        self.video_browser.sprites.shutdown()
+        self.page_images.thumbs.shutdown()
+        self.page_images.tasks.shutdown()
+        self.video_browser.tasks.shutdown()
         event.accept()
 
 
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+dedup.py
+截图近重复检测与清理（image/captures 里的 auto_* / photo_* 连拍常常只差一两秒、画面几乎相同）
+- dhash：缩小解码（IMREAD_REDUCED_GRAYSCALE_8）→ 9x8 灰度，整批在 numpy 里一次比较 / packbits
+- BKTree：按汉明距离的 BK 树，逐张查“半径内已有代表图”，近似 O(N log N)
+- group_duplicates()：只把时间上连续（与组内上一张相隔不超过 window 秒）的近重复归为一组，
+  固定机位下几分钟/几小时后画面相同的截图不会被并组
+- dedup_captures()：后台任务入口——补算缺失哈希、重建分组写回 CaptureIndex，可选只保留每组一张；
+  报警截图和带检测结果的截图优先作代表图，且从不删除
+"""
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+HASH_SIZE = 8           # 8x8 = 64 位
+DEFAULT_RADIUS = 6      # 汉明距离 ≤ 6 视为近重复（64 位中约 10%）
+DEFAULT_WINDOW_S = 3.0  # 与组内上一张相隔超过该秒数即不再并入该组（连拍间隔约 1 秒）
+BATCH = 256             # 每批解码/写库的张数（控制内存与提交频率）
+
+_MASK64 = (1 << 64) - 1
+
+
+# ==============================
+# 感知哈希
+# ==============================
+def _load_small_gray(path: str) -> Optional[np.ndarray]:
+    """解码为 (8, 9) 灰度；JPEG 走 1/8 降采样解码，基本不做全尺寸解码"""
+    img = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if img is None:
+        img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    return cv2.resize(img, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+
+
+def dhash_batch(grays: np.ndarray) -> np.ndarray:
+    """
+    grays: (N, 8, 9) uint8 → (N,) int64 差值哈希（位模式即 64 位无符号哈希，按有符号存便于 SQLite）
+    每行相邻像素左 > 右记 1，整批一次比较 + packbits，无 Python 循环
+    """
+    bits = grays[:, :, 1:] > grays[:, :, :-1]                 # (N, 8, 8) bool
+    packed = np.packbits(bits.reshape(len(grays), -1), axis=1)  # (N, 8) uint8，大端位序
+    return np.ascontiguousarray(packed).view(">u8").ravel().astype(np.uint64).view(np.int64)
+
+
+def compute_dhashes(paths: List[str]) -> List[Tuple[str, Optional[int]]]:
+    """[(path, 有符号 dhash 或 None（无法解码）)]"""
+    out: List[Tuple[str, Optional[int]]] = []
+    for i in range(0, len(paths), BATCH):
+        chunk = paths[i:i + BATCH]
+        smalls = [_load_small_gray(p) for p in chunk]
+        ok = [j for j, g in enumerate(smalls) if g is not None]
+        hashes = dhash_batch(np.stack([smalls[j] for j in ok])) if ok else []
+        got = dict(zip(ok, (int(h) for h in hashes)))
+        out.extend((p, got.get(j)) for j, p in enumerate(chunk))
+    return out
+
+
+def hamming(a: int, b: int) -> int:
+    return bin((a ^ b) & _MASK64).count("1")
+
+
+# ==============================
+# BK 树（汉明距离）
+# ==============================
+class BKTree:
+    """节点：[hash, item, {距离: 子节点}]；查询利用三角不等式只走 |d - r| 范围内的子树"""
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, h: int, item):
+        node = [h & _MASK64, item, {}]
+        self.size += 1
+        if self.root is None:
+            self.root = node
+            return
+        cur = self.root
+        while True:
+            d = hamming(node[0], cur[0])
+            nxt = cur[2].get(d)
+            if nxt is None:
+                cur[2][d] = node
+                return
+            cur = nxt
+
+    def query(self, h: int, radius: int) -> List[Tuple[int, object]]:
+        """返回 [(距离, item)]，按距离升序"""
+        if self.root is None:
+            return []
+        h &= _MASK64
+        found, stack = [], [self.root]
+        while stack:
+            node = stack.pop()
+            d = hamming(h, node[0])
+            if d <= radius:
+                found.append((d, node[1]))
+            lo, hi = d - radius, d + radius
+            stack.extend(child for k, child in node[2].items() if lo <= k <= hi)
+        found.sort(key=lambda x: x[0])
+        return found
+
+
+def group_duplicates(items: Iterable[Tuple[str, int, float, bool]], radius: int = DEFAULT_RADIUS,
+                     window: float = DEFAULT_WINDOW_S) -> Dict[str, str]:
+    """
+    items: [(path, dhash, mtime, protected)]，按时间正序给出
+    每组以最早的一张为基准（leader 聚类，只和基准比较哈希）；新图只并入上一张成员在 window 秒以内的组，
+    超时的组从 BK 树中移除。组内第一张 protected（报警/带检测结果）的图作代表图，没有则取最早的一张。
+    返回 dup_of：{近重复 path: 代表图 path}；结果与处理顺序一致、可复现
+    """
+    groups: List[List] = []          # [基准哈希, 上一张成员的 mtime, 成员列表, protected 代表图或 None]
+    active: Dict[str, List] = {}     # 基准 path -> 仍在时间窗内的组
+    tree = BKTree()
+    for path, h, t, protected in items:
+        stale = [k for k, g in active.items() if t - g[1] > window]
+        if stale:
+            for k in stale:
+                del active[k]
+            tree = BKTree()
+            for k, g in active.items():
+                tree.add(g[0], k)
+        hits = tree.query(h, radius)
+        if hits:
+            g = active[hits[0][1]]
+            g[1] = t
+            g[2].append(path)
+        else:
+            g = [h, t, [path], None]
+            groups.append(g)
+            active[path] = g
+            tree.add(h, path)
+        if protected and g[3] is None:
+            g[3] = path
+    dup_of: Dict[str, str] = {}
+    for _, _, members, rep in groups:
+        rep = rep or members[0]
+        dup_of.update((p, rep) for p in members if p != rep)
+    return dup_of
+
+
+# ==============================
+# 后台任务入口
+# ==============================
+def dedup_captures(index, d: str, radius: int = DEFAULT_RADIUS, compact: bool = False,
+                   window: float = DEFAULT_WINDOW_S) -> Dict:
+    """
+    index: CaptureIndex。步骤：
+      1) 对账目录并为缺少哈希的截图补算 dhash（分批写库，中途退出不丢进度）
+      2) 用 BK 树重建整目录的近重复分组（只并时间窗内的连拍），写回 dup_of
+      3) compact=True 时删除每组除代表图以外的文件，并从索引移除
+    返回报告：{"hashed", "unreadable", "groups", "duplicates", "dup_bytes", "kept", "removed", "reclaimed_bytes"}
+    只有有效哈希的图参与分组；清理只删这些分组里的非代表图，报警或带检测结果的截图一律保留（计入 kept）
+    """
+    index.sync(d)
+    todo = index.unhashed(d)
+    unreadable = 0
+    for i in range(0, len(todo), BATCH):
+        got = compute_dhashes(todo[i:i + BATCH])
+        # 无法解码的记为失败（不重试、不分组、不清理），不能当作哈希 0 和纯色图归为一组
+        index.set_hashes(got)
+        unreadable += sum(h is None for _, h in got)
+
+    rows = index.hashes(d)
+    sizes = {p: (sz or 0) for p, _, _, sz, _ in rows}
+    protected = {p for p, _, _, _, keep in rows if keep}
+    dup_of = group_duplicates(((p, h, t, bool(keep)) for p, h, t, _, keep in rows), radius, window)
+    index.set_groups(d, dup_of)
+
+    report = {
+        "hashed": len(todo) - unreadable,
+        "unreadable": unreadable,
+        "groups": len(set(dup_of.values())),
+        "duplicates": len(dup_of),
+        "dup_bytes": sum(sizes[p] for p in dup_of),
+        "kept": len(protected & dup_of.keys()),
+        "removed": 0,
+        "reclaimed_bytes": 0,
+    }
+    if compact and dup_of:
+        removed = []
+        for p in dup_of:
+            if p not in sizes or p in protected:  # 只删有有效哈希、且不是报警/带检测结果的图
+                continue
+            try:
+                os.remove(p)
+            except OSError as e:
+                print("[dedup] 删除失败:", p, e)
+                continue
+            removed.append(p)
+            report["reclaimed_bytes"] += sizes[p]
+        index.remove(removed)
+        report["removed"] = len(removed)
+    return report
+
+
+def format_report(report: Dict) -> str:
+    mb = 1024 * 1024
+    lines = [
+        f"新计算哈希：{report['hashed']} 张" + (f"（{report['unreadable']} 张无法解码，已跳过）"
+                                               if report.get("unreadable") else ""),
+        f"近重复分组：{report['groups']} 组，重复 {report['duplicates']} 张"
+        f"（占用 {report['dup_bytes'] / mb:.1f} MB）",
+    ]
+    if report["removed"]:
+        lines.append(f"已删除：{report['removed']} 张，释放 {report['reclaimed_bytes'] / mb:.1f} MB")
+    if report.get("kept"):
+        lines.append(f"保留：{report['kept']} 张重复图带有报警或检测结果，未删除")
+    return "\n".join(lines)
@@ -1,22 +1,148 @@
-
+import os
+import threading
 import time
 
 import torch
 import numpy as np
 
 from models.experimental import attempt_load
+from models.yolo import set_sparse_decode
 from utils.datasets import  letterbox
 from utils.general import non_max_suppression, \
     scale_coords,   set_logging
-from utils.torch_utils import select_device, time_synchronized
+from utils.torch_utils import select_device, time_synchronized, TracedModelCache
+
+try:
+    from .model_manager import Detections, get_model_manager
+    from .paths import writable_root
+except ImportError:
+    from model_manager import Detections, get_model_manager
+    from paths import writable_root
+
+# 自适应分辨率可选的输入尺寸（driving_detect.auto_imgsz），也是开启 trace 时预编译的尺寸
+ADAPTIVE_SIZES = (256, 320)
+# 驾驶员模型是否预先 trace（默认关闭）：trace 的输入固定为正方形 imgsz x imgsz，16:9 画面在 320 下
+# 由最小矩形 320x192 变为 320x320，单帧计算量约 1.67 倍；只在 JIT 收益大于该代价的设备上开启。
+# 实测（python models/yolo.py --bench-trace，yolov7，单核 CPU，torch 2.14，每帧 ms）：
+#   imgsz  eager 矩形  eager 正方形  trace 正方形   trace / eager 矩形
+#   256      206.2        341.9        319.4          0.65x
+#   320      258.6        387.5        427.8          0.60x
+#   416      499.6        742.4        767.1          0.65x
+#   640      982.8       1756.2       1867.4          0.53x
+# CPU 上 trace 相对同尺寸 eager 没有收益，且输入变大：各尺寸都更慢，因此保持关闭（GPU 上未测）
+TRACE_DRIVER_MODEL = False
+
+
+class YoloV7Detector:
+    """
+    驾驶员行为检测（仓库内 yolov7 attempt_load）的 Detector 实现，
+    由 ModelManager 按 (权重路径, 设备, 预编译尺寸) 共享、后台加载并预热。
+    trace_sizes 非空时，加载阶段为这些输入尺寸各 trace 一份（TracedModelCache，缓存在 trace_cache_dir 下，
+    按权重哈希 + torch 版本 + 尺寸区分，之后启动直接载入）；
+    detect(imgsz=...) 可在运行中切换分辨率：已 trace 的尺寸按正方形输入走 trace，其他尺寸走 eager 模型。
+    """
+    def __init__(self, weights='best.pt', device='cpu', imgsz=320, topk=0, trace_sizes=(), trace_cache_dir='traced_cache'):
+        self.device = device             # load() 时经 select_device 解析为 torch.device
+        self.weights = str(weights)
+        self.imgsz = int(imgsz)          # 默认输入尺寸（detect 未指定 imgsz 时使用）
+        self.topk = int(topk)            # 检测头稀疏解码：每个尺度最多保留的候选数（0 为不限）
+        self.trace_sizes = tuple(sorted(int(x) for x in trace_sizes))
+        self.trace_cache_dir = str(trace_cache_dir)  # trace 结果的磁盘缓存目录（需可写）
+        self.key = ("yolov7", self.weights, str(device), self.trace_sizes)
+        self.name = f"yolov7:{self.weights}@{device}"
+        self.model = None                # 融合后的 eager 模型
+        self.runner = None               # 实际前向：TracedModelCache（有 trace_sizes 时）或 model
+        self.stride = 32
+        self.names = {}
+        self._lock = threading.Lock()  # 同一模型被多个工作线程共用时串行前向
+
+    def load(self):
+        if not isinstance(self.device, torch.device):
+            self.device = select_device(self.device)
+        model = attempt_load(self.weights, map_location=self.device)  # load FP32 model
+        names = model.module.names if hasattr(model, 'module') else model.names
+        self.stride = int(model.stride.max())  # model stride  步长
+        self.names = dict(enumerate(names)) if isinstance(names, (list, tuple)) else dict(names)
+        runner = model
+        if self.trace_sizes:
+            try:
+                runner = TracedModelCache(model, self.weights, self.device, self.trace_sizes, self.trace_cache_dir)
+            except Exception as e:  # trace 失败不影响使用：退回 eager 模型
+                print(f"[yolov7] trace 失败，使用 eager 模型: {e!r}")
+        self.model, self.runner = model, runner
+
+    @property
+    def sizes(self):
+        """可无开销切换的输入尺寸（已 trace）；其他尺寸走 eager 模型"""
+        return tuple(getattr(self.runner, "traced", {}))
+
+    def warmup(self):
+        """每个输入尺寸跑两次空白输入：首帧的算子初始化/内存分配、JIT 的 profiling 优化都提前到加载阶段"""
+        p = next(self.model.parameters())
+        with torch.no_grad():
+            for s in self.sizes or (self.imgsz,):
+                for _ in range(2):
+                    self.runner(torch.zeros(1, 3, s, s, device=self.device, dtype=p.dtype))
+
+    def unload(self):
+        self.model, self.runner = None, None
+
+    def detect(self, frame, conf_thres=0.25, iou_thres=0.45, classes=None, agnostic=False, augment=False,
+               imgsz=None):
+        """
+        返回 Detections（原图坐标，timings 为本次的 (推理, NMS) 秒数）；
+        imgsz 为本次输入尺寸（None 用默认），已 trace 的尺寸按正方形输入
+        """
+        model, runner = self.model, self.runner
+        if model is None:
+            raise RuntimeError(f"{self.name} 未加载")
+        imgsz = int(imgsz or self.imgsz)
+        # 进行矩阵训练，把原来的图片画面进行缩放（trace 的形状固定为 imgsz x imgsz，不做最小矩形填充）
+        img = letterbox(frame, imgsz, stride=self.stride, auto=imgsz not in self.sizes)[0]
+        img = img[:, :, ::-1].transpose(2, 0, 1)  # rgb
+        img = np.ascontiguousarray(img)
+        img = torch.from_numpy(img).to(self.device)
+        img = img.half() if next(model.parameters()).dtype == torch.float16 else img.float()  # uint8 to fp16/32
+        img /= 255.0  # 0 - 255 to 0.0 - 1.0
+        if img.ndimension() == 3:
+            img = img.unsqueeze(0)
+
+        # Inference
+        with self._lock:
+            # 检测头只解码 obj > conf_thres 的候选（与 NMS 的候选过滤一致），座舱画面里绝大部分锚点直接跳过
+            set_sparse_decode(model, conf_thres, self.topk)
+            t1 = time_synchronized()
+            with torch.no_grad():  # Calculating gradients would cause a GPU memory leak
+                pred = runner(img, augment=augment)[0]
+            t2 = time_synchronized()
+
+        # Apply NMS
+        det = non_max_suppression(pred, conf_thres, iou_thres, classes=classes, agnostic=agnostic)[0]
+        t3 = time_synchronized()
+        timings = (t2 - t1, t3 - t2)
+
+        if not len(det):
+            return Detections.empty(self.names, timings)
+        # Rescale boxes from img_size to im0 size
+        det[:, :4] = scale_coords(img.shape[2:], det[:, :4], frame.shape).round()
+        det = det.cpu().numpy()
+        return Detections(det[:, :4].astype(np.float32), det[:, 4].astype(np.float32),
+                          det[:, 5].astype(np.int64), self.names, timings)
+
+
+def load_weights(weights, device, imgsz=320):
+    """已加载的权重由 ModelManager 共享，启动预加载与各页面复用同一份"""
+    return get_model_manager().get(YoloV7Detector(weights, device, imgsz)).model
+
+def driver_detector():
+    """驾驶员检测默认模型规格（driving_detect 与启动预加载共用，保证共享键一致）"""
+    return YoloV7Detector('best.pt', 'cpu', 320, trace_sizes=ADAPTIVE_SIZES if TRACE_DRIVER_MODEL else (),
+                          trace_cache_dir=os.path.join(writable_root(), "cache", "traced"))
+    # return YoloV7Detector('yolov7.pt', 'cpu', 320)
+
 
 class driving_detect():
-    def __init__(self):
-        self.device = 'cpu'
-        self.imgsz = 320
-        self.weights = 'best.pt'
-        # self.weights = 'yolov7.pt'
-        self.trace = False
+    def __init__(self, timeout=None):
         self.augment = False
         self.conf_thres = 0.25
         self.iou_thres = 0.45
@@ -25,13 +151,44 @@ class driving_detect():
 
         # Initialize
         set_logging()
-        self.device = select_device(self.device)
-        self.half = self.device.type != 'cpu'  # half precision only supported on CUDA
 
-        # Load model
-        self.model = attempt_load(self.weights, map_location=self.device)  # load FP32 model
-        self.stride = int(self.model.stride.max())  # model stride  步长
+        # Load model（ModelManager 共享；已预加载则直接复用，否则阻塞至加载 + 预热完成）
+        self.detector = get_model_manager().acquire(driver_detector(), timeout)
+        self.device = self.detector.device
+        self.imgsz = self.detector.imgsz
+        self.trace = bool(self.detector.sizes)
+        self.weights = self.detector.weights
+        self.model = self.detector.model
+        self.stride = self.detector.stride
+        # 自适应分辨率：推理耗时（EMA）超过预算降一档、低于一半预算升一档，在 ADAPTIVE_SIZES 间切换
+        self.auto_imgsz = False
+        self.infer_budget = 0.030  # 秒
+        self._infer_ema = None
+
+    def set_imgsz(self, imgsz):
+        """运行中切换输入分辨率（例如负载高时降到 256）：只影响本实例，下一帧生效；已 trace 的尺寸无需重新编译"""
+        self.imgsz = int(imgsz)
+
+    def _adapt_imgsz(self, t_inf):
+        self._infer_ema = t_inf if self._infer_ema is None else 0.8 * self._infer_ema + 0.2 * t_inf
+        sizes = ADAPTIVE_SIZES
+        if self.imgsz not in sizes:
+            return
+        k = sizes.index(self.imgsz)
+        if self._infer_ema > self.infer_budget and k > 0:
+            k -= 1
+        elif self._infer_ema < 0.5 * self.infer_budget and k + 1 < len(sizes):
+            k += 1
+        else:
+            return
+        self.set_imgsz(sizes[k])
+        self._infer_ema = None  # 新尺寸重新统计
 
+    def release(self):
+        """不再使用时归还模型引用（闲置后由 ModelManager 按内存预算卸载）"""
+        if self.detector is not None:
+            get_model_manager().release(self.detector)
+            self.detector, self.model = None, None
 
     def detect(self, frame):
         '''
@@ -39,58 +196,26 @@ class driving_detect():
         :param frame:
         :return: labels, boxs
         '''
-        #进行矩阵训练，把原来的图片画面进行缩放
-        img = letterbox(frame, self.imgsz, stride=self.stride)[0]
-        img = img[:, :, ::-1].transpose(2,0,1) #rgb
-        img = np.ascontiguousarray(img)
-
-        # Get names and colors
-        names = self.model.module.names if hasattr(self.model, 'module') else self.model.names
-
         t0 = time.time()
-        img = torch.from_numpy(img).to(self.device)
-        img = img.half() if self.half else img.float()  # uint8 to fp16/32
-        img /= 255.0  # 0 - 255 to 0.0 - 1.0
-        if img.ndimension() == 3:
-            img = img.unsqueeze(0)
-
-
-        # Inference
-        t1 = time_synchronized()
-        with torch.no_grad():  # Calculating gradients would cause a GPU memory leak
-            pred = self.model(img, augment=self.augment)[0]
-        t2 = time_synchronized()
-
-        # Apply NMS
-        pred = non_max_suppression(pred, self.conf_thres, self.iou_thres, classes=self.classes,
-                                   agnostic=self.agnostic_nms)
-
-        t3 = time_synchronized()
+        det = self.detector.detect(frame, self.conf_thres, self.iou_thres, classes=self.classes,
+                                   agnostic=self.agnostic_nms, augment=self.augment, imgsz=self.imgsz)
+        t_inf, t_nms = det.timings
+        if self.auto_imgsz:
+            self._adapt_imgsz(t_inf)
 
         labels = []
         boxs = []
 
-        # Process detections
-        for i, det in enumerate(pred):  # detections per image
-            s = ''
-
-            if len(det):
-                # Rescale boxes from img_size to im0 size
-                det[:, :4] = scale_coords(img.shape[2:], det[:, :4], frame.shape).round()
-
-                # Write results
-                for *xyxy, conf, cls in reversed(det):
-                    label = f'{names[int(cls)]}:{conf:.2f}'
-                    labels.append(label)
-                    box = [int(i.item()) for i in xyxy]
-                    boxs.append(box)
-
-            # Print time (inference + NMS)
-            print(f'{s}Done. ({(1E3 * (t2 - t1)):.1f}ms) Inference, ({(1E3 * (t3 - t2)):.1f}ms) NMS')
+        # Write results
+        for xyxy, conf, cls in zip(det.xyxy[::-1].tolist(), det.conf[::-1].tolist(), det.cls[::-1].tolist()):
+            labels.append(f'{det.names[cls]}:{conf:.2f}')
+            boxs.append([int(v) for v in xyxy])
 
+        # Print time (inference + NMS)
+        print(f'Done. ({(1E3 * t_inf):.1f}ms) Inference, ({(1E3 * t_nms):.1f}ms) NMS')
         print(f'Done. ({time.time() - t0:.3f}s)')
 
         if len(labels) == 0:
             return None,None
         else:
-            return labels, boxs
\ No newline at end of file
+            return labels, boxs
@@ -4,9 +4,11 @@ import sys
 
 import cv2,time
 import pymysql
-from datetime import date as _date
-from PyQt5.QtCore import Qt, QDate, QSize, pyqtSignal, QRectF, QThread, QTimer, pyqtSlot
-from PyQt5.QtGui import QImageReader, QFont
+from PyQt5.QtCore import (
+    Qt, QDate, QSize, pyqtSignal, QRectF, QThread, QTimer, pyqtSlot,
+    QObject, QRunnable, QThreadPool, QFileSystemWatcher, QAbstractListModel, QModelIndex
+)
+from PyQt5.QtGui import QImageReader, QImageIOHandler, QFont
 from PyQt5.QtWidgets import (
     QGraphicsView, QGraphicsScene, QGraphicsPixmapItem,
     QAction, QToolBar, QApplication, QScrollArea, QProgressBar
@@ -18,57 +20,32 @@ from PyQt5.QtGui import (
 from PyQt5.QtWidgets import (
     QWidget, QLabel, QPushButton, QFileDialog, QVBoxLayout, QHBoxLayout,
     QLineEdit, QMessageBox, QFormLayout, QDialog, QDialogButtonBox, QFrame,
-    QGridLayout, QGraphicsDropShadowEffect, QListWidget, QListWidgetItem, QDateEdit, QSlider
+    QGridLayout, QGraphicsDropShadowEffect, QListWidget, QListWidgetItem, QDateEdit, QSlider,
+    QListView, QCheckBox, QComboBox, QDoubleSpinBox
 )
 try:
     # 当从项目根目录运行 main.py 时（推荐方式）
+    from .paths import is_frozen, resource_path, writable_root
     from .road_scene_ultra import RoadSceneAnalyzer, AnalyzerConfig
+    from .thumb_cache import ThumbLoader, PixmapLRU, render_video_sprite, render_image_thumb
+    from .media_index import recording_index, capture_index
+    from .image_pyramid import TiledImageItem, build_pyramid
+    from .dedup import dedup_captures, format_report
+    from .model_manager import get_model_manager
 except ImportError:
     # 当直接在 view 目录里跑 app.py 时（老习惯）
+    from paths import is_frozen, resource_path, writable_root
     from road_scene_ultra import RoadSceneAnalyzer, AnalyzerConfig
+    from thumb_cache import ThumbLoader, PixmapLRU, render_video_sprite, render_image_thumb
+    from media_index import recording_index, capture_index
+    from image_pyramid import TiledImageItem, build_pyramid
+    from dedup import dedup_captures, format_report
+    from model_manager import get_model_manager
 
 
 # ==============================
-# 路径 & 打包工具
+# 路径 & 打包工具（is_frozen / resource_path / writable_root 在 paths.py，这里导入后照常可用）
 # ==============================
-def is_frozen() -> bool:
-    """判断当前是否为 PyInstaller 打包环境"""
-    return hasattr(sys, "_MEIPASS")
-
-def resource_path(*relative_parts) -> str:
-    """
-    读取只读资源（图片/图标/模型等）路径：
-    - 开发期：smart_driving/ 根目录
-    - 打包后：_MEIPASS 临时目录
-    用法：resource_path('image','icons','home.png')
-    """
-    if is_frozen():
-        base = Path(getattr(sys, "_MEIPASS"))
-    else:
-        # 本文件通常位于 smart_driving/view/ 或 smart_driving/ 下
-        base = Path(__file__).resolve().parent.parent
-    return str(base.joinpath(*relative_parts))
-
-def writable_root() -> str:
-    """
-    返回可写根目录：
-    - 开发期：smart_driving/image/
-    - 打包后：系统用户目录（Windows: %APPDATA%，macOS: ~/Library/Application Support，Linux: ~/.local/share）/smart_driving
-    """
-    if is_frozen():
-        home = Path.home()
-        if sys.platform.startswith("win"):
-            base = Path(os.getenv("APPDATA", home / "AppData" / "Roaming"))
-        elif sys.platform == "darwin":
-            base = home / "Library" / "Application Support"
-        else:
-            base = home / ".local" / "share"
-        root = base / "smart_driving"
-    else:
-        root = Path(resource_path("image"))
-    root.mkdir(parents=True, exist_ok=True)
-    return str(root)
-
 def resolve_avatar_abs(rel_path: str) -> str:
     """把数据库中的相对头像路径（例如 imgpath/26.png）解析为绝对路径"""
     rel_path = rel_path.replace("\\", "/")
@@ -82,6 +59,51 @@ def ensure_avatar_dir():
     """确保头像目录存在"""
     Path(resolve_avatar_abs("imgpath")).mkdir(parents=True, exist_ok=True)
 
+def media_db_path() -> str:
+    """媒体索引数据库（录像/截图目录的持久化索引）"""
+    return str(Path(writable_root()) / "cache" / "media_index.sqlite")
+
+def get_recording_index():
+    """videos/ 录像索引（进程内共享同一实例）"""
+    return recording_index(media_db_path(), resource_path("videos"))
+
+def get_capture_index():
+    """截图索引（进程内共享同一实例；各截图写入方保存后调用 add()）"""
+    return capture_index(media_db_path())
+
+# ==============================
+# 后台任务（线程池执行，结果回到 GUI 线程）
+# ==============================
+class _Task(QRunnable):
+    def __init__(self, owner: "BackgroundTasks", name: str, fn, args, kwargs):
+        super().__init__()
+        self.owner, self.name = owner, name
+        self.fn, self.args, self.kwargs = fn, args, kwargs
+
+    def run(self):
+        result = None
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            print(f"[BackgroundTasks] {self.name} 失败:", e)
+        self.owner.finished.emit(self.name, result)
+
+class BackgroundTasks(QObject):
+    """submit(name, fn, ...) 在线程池里执行 fn；完成后在 GUI 线程发出 finished(name, result)"""
+    finished = pyqtSignal(str, object)
+
+    def __init__(self, max_threads: int = 1, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+
+    def submit(self, name: str, fn, *args, priority: int = 0, **kwargs):
+        self.pool.start(_Task(self, name, fn, args, kwargs), priority)
+
+    def shutdown(self, wait_ms: int = 1000):
+        self.pool.clear()
+        self.pool.waitForDone(wait_ms)
+
 # ==============================
 # MySQL 访问（与登录注册保持一致，MD5）
 # ==============================
@@ -506,19 +528,58 @@ class PasswordDialog(QDialog):
 # ------------------ 视频播放页面（改动后的完整代码） ------------------
 from pathlib import Path
 # ====================== 视频播放（页面版，线程安全、不阻塞UI） ======================
+def decimation_step(src_fps: float, target_fps: float) -> int:
+    """每呈现/分析 1 帧需要前进的源帧数（>=1）"""
+    if not target_fps or target_fps <= 0 or not src_fps or src_fps <= 0:
+        return 1
+    return max(1, int(math.ceil(src_fps / target_fps - 1e-6)))
+
+
+def iter_video_frames(path: str, sample_fps: float = None):
+    """
+    逐帧读取视频，yield (帧号, 时间秒, BGR帧)；供批处理/离线分析复用
+    - sample_fps 给定时按该帧率抽帧：中间帧只 grab() 不解码（例如“按 5fps 分析”）
+    """
+    cap = cv2.VideoCapture(path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+        step = decimation_step(fps, sample_fps)
+        idx = 0
+        while True:
+            for _ in range(step - 1):
+                if not cap.grab():
+                    return
+                idx += 1
+            ok, frame = cap.read()
+            if not ok or frame is None:
+                return
+            yield idx, idx / fps, frame
+            idx += 1
+    finally:
+        cap.release()
+
+
 class _VideoReader(QThread):
     """
     后台读取视频帧的线程：
     - 发出 BGR ndarray 帧（由页面在 GUI 线程里转 QImage/QPixmap）
     - 支持暂停、改变播放速度、停止
+    - 倍速 > 1 时按显示能力抽帧：中间帧只 grab()（不解码、不发出），
+      呈现帧率不超过 min(源帧率, 屏幕刷新率)
+    - sample_fps：分析抽帧（例如检测页“按 5fps 分析”），与倍速抽帧取较大步长
     """
     frame = pyqtSignal(object)   # np.ndarray (BGR)
+    stamped = pyqtSignal(object, float)  # (BGR 帧, 该帧的视频时间 秒)：分析页按视频时间跟踪
+    position = pyqtSignal(float) # 当前帧在视频中的时间（毫秒）
     ended = pyqtSignal()         # 到达文件末尾或异常
 
-    def __init__(self, path: str, speed: float = 1.0, parent=None):
+    def __init__(self, path: str, speed: float = 1.0, display_fps: float = 60.0,
+                 sample_fps: float = None, parent=None):
         super().__init__(parent)
         self.path = path
         self.speed = max(0.25, float(speed))
+        self.display_fps = float(display_fps) if display_fps and display_fps > 1 else 60.0
+        self.sample_fps = sample_fps
         self._stop = False
         self._paused = False
 
@@ -531,22 +592,37 @@ class _VideoReader(QThread):
     def set_speed(self, s: float):
         self.speed = max(0.25, float(s))
 
+    def _step(self, fps: float) -> int:
+        present_fps = min(fps, self.display_fps)
+        step = decimation_step(fps * self.speed, present_fps)
+        return max(step, decimation_step(fps, self.sample_fps))
+
     def run(self):
         cap = None
         try:
             cap = cv2.VideoCapture(self.path)
             fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
             delay_ms = max(5.0, 1000.0 / fps)
+            idx = 0
 
             while not self._stop:
                 if self._paused:
                     self.msleep(30)
                     continue
+                step = self._step(fps)
+                skipped = 0
+                while skipped < step - 1 and cap.grab():
+                    skipped += 1
+                if skipped < step - 1:
+                    break
                 ok, frame = cap.read()
                 if not ok or frame is None:
                     break
+                idx += step
+                self.stamped.emit(frame, (idx - 1) / fps)
                 self.frame.emit(frame)
-                self.msleep(int(delay_ms / self.speed))
+                self.position.emit((idx - 1) * 1000.0 / fps)
+                self.msleep(int(delay_ms * step / self.speed))
         except Exception:
             pass
         finally:
@@ -654,9 +730,12 @@ class VideoPage(QWidget):
         except Exception:
             self._fps, self._duration_ms = 25.0, None
 
-        # 启动后台读帧线程
-        self.reader = _VideoReader(path=path, speed=self._speed)
+        # 启动后台读帧线程（倍速时按屏幕刷新率抽帧）
+        screen = QApplication.primaryScreen()
+        self.reader = _VideoReader(path=path, speed=self._speed,
+                                   display_fps=screen.refreshRate() if screen else 60.0)
         self.reader.frame.connect(self._on_frame)   # NEW: 接收一帧并显示
+        self.reader.position.connect(self._on_position)
         self.reader.ended.connect(self._on_reader_end)
         self.reader.start()
 
@@ -676,11 +755,13 @@ class VideoPage(QWidget):
         qimg = QImage(rgb.data, w, h, ch * w, QImage.Format_RGB888)
         pix = QPixmap.fromImage(qimg).scaled(self.label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
         self.label.setPixmap(pix)
-
-        # 估计当前位置（按 fps 累加）
-        self._pos_ms += (1000.0 / max(1e-6, self._fps)) / max(1e-6, self._speed)
         self._last_frame = frame.copy()
 
+    @pyqtSlot(float)
+    def _on_position(self, ms: float):
+        # 读帧线程按帧号换算的位置（抽帧时也准确）
+        self._pos_ms = ms
+
     # ========= 线程结束（NEW） =========
     @pyqtSlot()
     def _on_reader_end(self):
@@ -723,9 +804,11 @@ class VideoPage(QWidget):
         try:
             os.makedirs(save_dir, exist_ok=True)
             fn = os.path.join(save_dir, f"shot_{time.strftime('%Y%m%d_%H%M%S')}.jpg")
+            dir_before = get_capture_index().dir_mtime(save_dir)
             # _last_frame 是 BGR，cv2.imwrite 直接可用
             ok = cv2.imwrite(fn, self._last_frame)
             if ok:
+                get_capture_index().add(fn, source="video", dir_mtime_before=dir_before)
                 QMessageBox.information(self, "提示", f"已保存当前视频帧：\n{fn}")
             else:
                 QMessageBox.warning(self, "提示", "截图失败（写入文件失败）。")
@@ -741,7 +824,7 @@ class VideoPage(QWidget):
         elif hasattr(main, "page_main"):
             main.stack.setCurrentWidget(main.page_main)
 
-    # ========= 进度条刷新（CHG：用累加的 _pos_ms） =========
+    # ========= 进度条刷新（CHG：用读帧线程上报的 _pos_ms） =========
     def _tick_progress(self):
         if self._duration_ms:
             v = max(0, min(1000, int(self._pos_ms / self._duration_ms * 1000)))
@@ -773,17 +856,21 @@ class Video1DetectPage(QWidget):
     - 去掉倍速相关控件
     - 保留 capture_frame() 供底部截图按钮使用
     """
-    def __init__(self, default_path: str = None, parent=None):
+    def __init__(self, default_path: str = None, analyze_fps: float = None, parent=None):
         super().__init__(parent)
         self._path = default_path
+        self.analyze_fps = analyze_fps   # None：逐帧分析；例如 5：按 5fps 抽帧分析（其余帧只 grab）
         self._reader: _VideoReader = None
         self._current_frame = None
+        self._current_info = None        # (时间戳, analyzer info)：与 _current_frame 对应的检测结果
+        self._present_pix: QPixmap = None  # 当前呈现帧（原尺寸）；窗口缩放时只重缩放它，不重新分析
         self._playing = False
 
         # === Ultralytics + BEV 分析器 ===
-        self.analyzer = RoadSceneAnalyzer(
-            AnalyzerConfig(model_path="yolov8n.pt")  # 可换 yolov8s.pt 等
-        )
+        # 模型由 ModelManager 后台加载 + 预热，就绪后才创建分析器（构造页面时不加载权重）
+        self._analyzer_cfg = AnalyzerConfig(model_path="yolov8n.pt")  # 可换 yolov8s.pt 等
+        self._detector_spec = RoadSceneAnalyzer.detector_for(self._analyzer_cfg)
+        self.analyzer: RoadSceneAnalyzer = None
 
         self.setStyleSheet("background:#18191d; color:#e6e6e6;")
 
@@ -812,6 +899,12 @@ class Video1DetectPage(QWidget):
         layout.addWidget(self.video_label, 1)
         layout.addLayout(ctl)
 
+        # 拖动窗口时 resize 事件很密：停下后再按新尺寸缩放一次
+        self._resize_timer = QTimer(self)
+        self._resize_timer.setSingleShot(True)
+        self._resize_timer.setInterval(60)
+        self._resize_timer.timeout.connect(self._rescale)
+
     # ============ 对外API ============
     def play(self, path: str):
         if not path or not os.path.exists(path):
@@ -820,9 +913,10 @@ class Video1DetectPage(QWidget):
         self.stop()
         self._path = path
         self.video_label.setText("正在加载…")
-        # 线程启动（不需要速度参数）
-        self._reader = _VideoReader(self._path, parent=self)
-        self._reader.frame.connect(self._on_frame)
+        get_model_manager().prefetch(self._detector_spec)
+        # 线程启动（不需要速度参数；可选按 analyze_fps 抽帧）
+        self._reader = _VideoReader(self._path, sample_fps=self.analyze_fps, parent=self)
+        self._reader.stamped.connect(self._on_frame)
         self._reader.ended.connect(self._on_ended)
         self._reader.start()
         self._playing = True
@@ -838,6 +932,9 @@ class Video1DetectPage(QWidget):
             pass
         self._reader = None
         self._current_frame = None
+        self._current_info = None
+        self._present_pix = None
+        self._resize_timer.stop()
         self.btn_play.setText("播放")
 
     def capture_frame(self, save_dir: str) -> str:
@@ -854,29 +951,58 @@ class Video1DetectPage(QWidget):
             h, w, _ = rgb.shape
             qimg = QImage(rgb.data, w, h, w*3, QImage.Format_RGB888)
             pm = QPixmap.fromImage(qimg)
+            dir_before = get_capture_index().dir_mtime(save_dir)
             pm.save(path, "PNG")
+            det_ts, info = self._current_info if self._current_info is not None else (None, {})
+            get_capture_index().add(path, source="video1", detections=info.get("detections"),
+                                    alarm=info.get("alarm"), det_ts=det_ts, dir_mtime_before=dir_before)
             return path
         except Exception as e:
             QMessageBox.warning(self, "提示", f"保存失败：{e}")
             return ""
 
     # ============ 槽函数 ============
-    def _on_frame(self, bgr):
+    def _on_frame(self, bgr, t=None):
         """
-        每帧调用分析器，得到 overlay（叠加框与文字），
-        并把 overlay 同步到 QLabel。_current_frame 保存 overlay 以便截图。
+        每帧先 analyze() 得到 info，再 render() 叠加框与文字，
+        并把 overlay 交给 _present() 显示。_current_frame 保存 overlay 以便截图。
+        读取线程每帧发出新数组，这里直接在 bgr 上原地绘制，省掉一次整帧拷贝。
         """
         try:
-            overlay, info = self.analyzer.update(bgr)
+            if self._ensure_analyzer():
+                info = self.analyzer.analyze(bgr, t)
+                overlay = self.analyzer.render(bgr, info, out=bgr)
+                self._current_info = (time.time(), info)  # 截图时一并写入检测元数据
+            else:
+                overlay = bgr  # 模型仍在后台加载：先显示原始画面
+                self._current_info = None
             self._current_frame = overlay  # 保存叠加后的画面
-            rgb = cv2.cvtColor(overlay, cv2.COLOR_BGR2RGB)
-            h, w, ch = rgb.shape
-            qimg = QImage(rgb.data, w, h, ch*w, QImage.Format_RGB888)
-            pm = QPixmap.fromImage(qimg).scaled(self.video_label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
-            self.video_label.setPixmap(pm)
+            self._present(overlay)
         except Exception as e:
             print("Video1DetectPage 分析错误:", e)
 
+    def _present(self, overlay):
+        """缓存原尺寸 QPixmap 并按 label 尺寸显示（只做显示，不涉及分析状态）"""
+        rgb = cv2.cvtColor(overlay, cv2.COLOR_BGR2RGB)
+        h, w, ch = rgb.shape
+        qimg = QImage(rgb.data, w, h, ch*w, QImage.Format_RGB888)
+        self._present_pix = QPixmap.fromImage(qimg)
+        self._rescale()
+
+    def _rescale(self):
+        if self._present_pix is None:
+            return
+        pm = self._present_pix.scaled(self.video_label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        self.video_label.setPixmap(pm)
+
+    def _ensure_analyzer(self) -> bool:
+        if self.analyzer is None and get_model_manager().ready(self._detector_spec):
+            try:
+                self.analyzer = RoadSceneAnalyzer(self._analyzer_cfg)
+            except Exception as e:
+                print("RoadSceneAnalyzer 初始化失败:", e)
+        return self.analyzer is not None
+
     def _on_ended(self):
         self._playing = False
         self.btn_play.setText("播放")
@@ -908,30 +1034,112 @@ class Video1DetectPage(QWidget):
         if path:
             self.play(path)
 
-    # 自适应窗口：下次到帧时按 label 尺寸缩放
+    # 自适应窗口：只重缩放已呈现的帧（不重跑检测、不推进跟踪/报警状态），连续 resize 合并为一次
     def resizeEvent(self, e):
         super().resizeEvent(e)
-        if self._current_frame is not None:
-            # 触发一次重绘：把缓存帧重新塞回管道
-            self._on_frame(self._current_frame)
+        if self._present_pix is not None:
+            self._resize_timer.start()
 
     def closeEvent(self, e):
         self.stop()
+        if self.analyzer is not None:  # 归还共享模型，闲置后可按内存预算卸载
+            self.analyzer.release()
+            self.analyzer = None
         super().closeEvent(e)
 
 
 # ------------------ 视频库（预览 + 点击播放） ------------------
 # ================== 按日期查询的视频库 ==================
+class _ScrubThumb(QLabel):
+    """
+    缩略图卡片上的画面：鼠标悬停时按横坐标在拼图（sprite）里取对应那一秒的小图，
+    不打开解码器；移出后恢复首帧缩略图
+    """
+    def __init__(self, tile_size, parent=None):
+        super().__init__(parent)
+        self.setMouseTracking(True)
+        self.tile_w, self.tile_h = tile_size
+        self.thumb = None    # QPixmap：首帧缩略图
+        self.sprite = None   # QPixmap：横向拼图
+        self._tile = -1
+
+    def set_thumb(self, pix: QPixmap):
+        self.thumb = pix
+        if self._tile < 0:
+            self.setPixmap(pix)
+
+    def set_sprite(self, pix: QPixmap):
+        self.sprite = pix if pix.width() >= self.tile_w else None
+
+    def mouseMoveEvent(self, e):
+        super().mouseMoveEvent(e)
+        if self.sprite is None:
+            return
+        n = self.sprite.width() // self.tile_w
+        k = min(n - 1, max(0, int(e.x() / max(1, self.width()) * n)))
+        if k == self._tile:
+            return
+        self._tile = k
+        tile = self.sprite.copy(k * self.tile_w, 0, self.tile_w, self.tile_h)
+        self.setPixmap(tile.scaled(self.size(), Qt.KeepAspectRatio, Qt.FastTransformation))
+
+    def leaveEvent(self, e):
+        super().leaveEvent(e)
+        self._tile = -1
+        if self.thumb is not None:
+            self.setPixmap(self.thumb)
+
+
 class VideoBrowserPage(QWidget):
     """
     视频浏览页：显示缩略图 + 日期筛选 + 双击播放
+    - 按日期查询走录像索引（media_index），目录变化时后台增量对账
+    - 缩略图由后台线程池生成并缓存到磁盘（键：路径+大小+修改时间）
+    - 卡片先以占位图出现，缩略图到达后再填充
+    - 只创建视口附近的卡片，滚动到底部附近时再继续补充
+    - 悬停拼图（每秒一帧）在缩略图之后低优先级生成并缓存，悬停即可拖动预览
     """
+    COLS = 4
+    THUMB_W, THUMB_H = 260, 160
+    SPRITE_TILE = (160, 90)
+    CARD_H = 200            # 卡片（缩略图 + 标题 + 间距）的近似高度，用于估算可见行数
+    PREFETCH_ROWS = 2       # 视口下方额外预建的行数
+
     def __init__(self, target_page: QWidget, parent=None):
         super().__init__(parent)
         self.target_page = target_page
         self.video_dir = Path(resource_path("videos"))
         self.video_dir.mkdir(parents=True, exist_ok=True)
 
+        # 缩略图：后台生成 + 磁盘缓存
+        self.thumbs = ThumbLoader(
+            str(Path(writable_root()) / "cache" / "thumbs"),
+            (self.THUMB_W, self.THUMB_H), parent=self
+        )
+        self.thumbs.ready.connect(self._on_thumb_ready)
+        # 悬停拼图：单独的单线程池，不和首帧缩略图抢资源
+        self.sprites = ThumbLoader(
+            str(Path(writable_root()) / "cache" / "sprites"),
+            self.SPRITE_TILE, renderer=render_video_sprite, tag="sprite",
+            max_threads=1, parent=self
+        )
+        self.sprites.ready.connect(self._on_sprite_ready)
+        self._files = []          # 当前查询结果（Path 列表）
+        self._cards = {}          # str(path) -> 缩略图 QLabel
+        self._materialized = 0    # 已创建的卡片数
+
+        # 录像索引：查询只查库；目录变化（去抖）后在后台增量对账
+        self.index = get_recording_index()
+        self.tasks = BackgroundTasks(parent=self)
+        self.tasks.finished.connect(self._on_task_done)
+        self._syncing = False
+        self._sync_timer = QTimer(self)
+        self._sync_timer.setSingleShot(True)
+        self._sync_timer.setInterval(1500)
+        self._sync_timer.timeout.connect(self._start_sync)
+        self.watcher = QFileSystemWatcher([str(self.video_dir)], self)
+        self.watcher.directoryChanged.connect(lambda _: self._sync_timer.start())
+
         # === 顶部筛选栏 ===
         bar = QWidget()
         bl = QHBoxLayout(bar)
@@ -962,81 +1170,114 @@ class VideoBrowserPage(QWidget):
         self.grid = QGridLayout()
         self.grid.setContentsMargins(10, 10, 10, 10)
         self.grid.setSpacing(10)
+        self.grid.setAlignment(Qt.AlignTop | Qt.AlignLeft)
         container = QWidget()
         container.setLayout(self.grid)
 
-        scroll = QScrollArea()
-        scroll.setWidgetResizable(True)
-        scroll.setWidget(container)
-        scroll.setStyleSheet("background:#f5f5f5;")
+        self.scroll = QScrollArea()
+        self.scroll.setWidgetResizable(True)
+        self.scroll.setWidget(container)
+        self.scroll.setStyleSheet("background:#f5f5f5;")
+        self.scroll.verticalScrollBar().valueChanged.connect(self._materialize_visible)
 
         # === 主布局 ===
         layout = QVBoxLayout(self)
         layout.addWidget(bar)
-        layout.addWidget(scroll, 1)
+        layout.addWidget(self.scroll, 1)
 
         btn_query.clicked.connect(self.refresh_thumbnails)
         btn_open.clicked.connect(self.open_folder)
 
-        # 首次加载当天
+        # 首次加载当天（先用已有索引，再后台对账一次）
         self.refresh_thumbnails()
+        self._start_sync()
+
+    def _start_sync(self):
+        if self._syncing:
+            self._sync_timer.start()  # 正在对账：稍后再来一次
+            return
+        self._syncing = True
+        self.tasks.submit("sync", self.index.sync)
+
+    def _on_task_done(self, name: str, result):
+        if name != "sync":
+            return
+        self._syncing = False
+        d = self.date_edit.date().toPyDate()
+        if [Path(p) for p in self.index.query_date(d)] != self._files:
+            self.refresh_thumbnails()
 
     def refresh_thumbnails(self):
-        """加载符合日期的视频缩略图"""
-        import datetime, os, cv2
+        """加载符合日期的视频缩略图（索引查询，不遍历目录）"""
         d = self.date_edit.date().toPyDate()
-        prefix = d.strftime("%Y-%m-%d") + "_"
-        exts = (".mp4", ".avi", ".mkv", ".mov")
+
+        # 丢弃上一次查询尚未完成的缩略图任务
+        self.thumbs.cancel_all()
+        self.sprites.cancel_all()
 
         # 清空旧缩略图
         while self.grid.count():
             w = self.grid.takeAt(0).widget()
             if w:
                 w.deleteLater()
+        self._cards.clear()
+        self._materialized = 0
 
-        files = []
-        for p in sorted(self.video_dir.glob("*")):
-            if not p.is_file() or p.suffix.lower() not in exts:
-                continue
-
-            # 文件名日期或修改日期匹配
-            by_name = p.name.startswith(prefix)
-            mdate = datetime.date.fromtimestamp(p.stat().st_mtime)
-            by_mtime = (mdate == d)
-
-            if by_name or by_mtime:
-                files.append(p)
+        # 文件名日期或修改日期匹配
+        files = [Path(p) for p in self.index.query_date(d)]
+        self._files = files
 
         if not files:
             self.grid.addWidget(QLabel("没有找到该日期的视频。"))
             return
 
-        # 生成缩略图
-        for i, p in enumerate(files):
-            thumb = self.make_thumbnail_widget(p)
-            row, col = divmod(i, 4)
-            self.grid.addWidget(thumb, row, col)
-
-    def make_thumbnail_widget(self, path: Path):
-        """生成单个缩略图卡片"""
-        import cv2
-        cap = cv2.VideoCapture(str(path))
-        ret, frame = cap.read()
-        cap.release()
+        self.scroll.verticalScrollBar().setValue(0)
+        self._materialize_visible()
 
-        label = QLabel()
-        label.setFixedSize(260, 160)
-        label.setAlignment(Qt.AlignCenter)
-        label.setStyleSheet("background:#000; border-radius:6px;")
-        if ret:
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            h, w, _ = frame.shape
-            qimg = QImage(frame.data, w, h, 3 * w, QImage.Format_RGB888)
-            pix = QPixmap.fromImage(qimg).scaled(260, 160, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-            label.setPixmap(pix)
-        else:
+    def _materialize_visible(self, *_):
+        """把卡片补建到“视口底部 + PREFETCH_ROWS 行”为止"""
+        if self._materialized >= len(self._files):
+            return
+        top = self.scroll.verticalScrollBar().value()
+        view_h = max(self.CARD_H, self.scroll.viewport().height())
+        rows = math.ceil((top + view_h) / self.CARD_H) + self.PREFETCH_ROWS
+        want = min(len(self._files), rows * self.COLS)
+        while self._materialized < want:
+            p = self._files[self._materialized]
+            row, col = divmod(self._materialized, self.COLS)
+            self.grid.addWidget(self.make_thumbnail_widget(p), row, col)
+            self.thumbs.request(str(p))
+            self.sprites.request(str(p))
+            self._materialized += 1
+
+    def _on_thumb_ready(self, path: str, qimg: QImage, generation: int):
+        if generation != self.thumbs.generation:
+            return
+        label = self._cards.get(path)
+        if label is None:
+            return
+        if qimg.isNull():
             label.setText("无缩略图")
             label.setStyleSheet("color:white;background:#000;")
+        else:
+            label.setText("")
+            label.set_thumb(QPixmap.fromImage(qimg))
+
+    def _on_sprite_ready(self, path: str, qimg: QImage, generation: int):
+        if generation != self.sprites.generation or qimg.isNull():
+            return
+        label = self._cards.get(path)
+        if label is not None:
+            label.set_sprite(QPixmap.fromImage(qimg))
+
+    def make_thumbnail_widget(self, path: Path):
+        """生成单个缩略图卡片（先放占位，缩略图由 _on_thumb_ready 回填）"""
+        label = _ScrubThumb(self.SPRITE_TILE)
+        label.setText("加载中…")
+        label.setFixedSize(self.THUMB_W, self.THUMB_H)
+        label.setAlignment(Qt.AlignCenter)
+        label.setStyleSheet("color:#888; background:#000; border-radius:6px;")
+        self._cards[str(path)] = label
 
         title = QLabel(path.name)
         title.setAlignment(Qt.AlignCenter)
@@ -1052,6 +1293,14 @@ class VideoBrowserPage(QWidget):
         widget.mouseDoubleClickEvent = lambda e, p=path: self.play_video(p)
         return widget
 
+    def resizeEvent(self, e):
+        super().resizeEvent(e)
+        self._materialize_visible()
+
+    def showEvent(self, e):
+        super().showEvent(e)
+        self._materialize_visible()
+
     def play_video(self, path: Path):
         """双击播放"""
         if hasattr(self.target_page, "play"):
@@ -1070,18 +1319,14 @@ class VideoBrowserPage(QWidget):
 
 
 # --------------------图片浏览---------------------------------------
-# 小工具：取文件的“修改日期”（本地时区按天）
-def _file_mdate(path: str):
-    try:
-        t = os.path.getmtime(path)
-        return _date.fromtimestamp(t)
-    except Exception:
-        return None
-
-
 class ImageViewerDialog(QDialog):
-    """弹出式图片预览，可缩放/旋转/平移，带工具条（修复 _act_fit 初始化顺序）"""
-    def __init__(self, pixmap: QPixmap, parent=None):
+    """
+    弹出式图片预览，可缩放/旋转/平移，带工具条（修复 _act_fit 初始化顺序）
+    - source 可以是图片路径、QImage 或 QPixmap；preview 为金字塔就绪前先显示的小图（如列表缩略图）
+    - 图像金字塔在后台线程构建一次；绘制时按缩放倍率选层，只画可见分块，
+      缩放/旋转只改视图变换，不再对整图重新采样
+    """
+    def __init__(self, source, parent=None, preview: QPixmap = None):
         super().__init__(parent)
         self.setWindowTitle("图片预览")
         self.setModal(True)
@@ -1110,10 +1355,13 @@ class ImageViewerDialog(QDialog):
         self._rotation = 0.0
         self._fit_mode = True  # 初次适配
 
-        self.pix_item = QGraphicsPixmapItem()
-        self.pix_item.setTransformationMode(Qt.SmoothTransformation)
+        self.pix_item = TiledImageItem()
         self.scene.addItem(self.pix_item)
 
+        # 金字塔在后台构建，完成后在 GUI 线程换上分块绘制
+        self.tasks = BackgroundTasks(parent=self)
+        self.tasks.finished.connect(self._on_task_done)
+
         # ====== 工具条======
         tb = QToolBar(self)
         tb.setMovable(False)
@@ -1141,13 +1389,56 @@ class ImageViewerDialog(QDialog):
         self.view.mouseReleaseEvent = self._mouseReleaseEvent_proxy
 
         # 最后再设置图像
-        if isinstance(pixmap, QPixmap) and not pixmap.isNull():
-            self._set_pixmap(pixmap)
+        self._set_source(source, preview)
 
     # ---------- 图像与变换 ----------
-    def _set_pixmap(self, pm: QPixmap):
-        self.pix_item.setPixmap(pm)
-        self.pix_item.setOffset(-pm.width() / 2, -pm.height() / 2)  # 图像中心在原点
+    def _set_source(self, source, preview: QPixmap = None):
+        size = None
+        if isinstance(source, QPixmap):
+            if source.isNull():
+                return
+            if preview is None:
+                preview = source
+            source = source.toImage()  # QImage 才能交给工作线程
+        if isinstance(source, QImage):
+            if source.isNull():
+                return
+            size = (source.width(), source.height())
+        elif isinstance(source, (str, Path)):
+            source = str(source)
+            reader = QImageReader(source)
+            reader.setAutoTransform(True)
+            sz = reader.size()
+            if sz.isValid():
+                if reader.transformation() & QImageIOHandler.TransformationRotate90:
+                    sz.transpose()
+                size = (sz.width(), sz.height())
+        else:
+            return
+        self.pix_item.set_preview(preview, size)  # 图像中心在原点
+        if not self.pix_item.is_empty():
+            self._reset_view()
+        self.tasks.submit("pyramid", build_pyramid, source)
+
+    def _on_task_done(self, name: str, result):
+        if name != "pyramid":
+            return
+        if result is None:
+            if self.pix_item.preview is None:
+                QMessageBox.warning(self, "提示", "无法加载图片。")
+            return
+        first = self.pix_item.is_empty()
+        changed = (result.width, result.height) != self.pix_item.image_size()
+        self.pix_item.set_pyramid(result)
+        if first:
+            self._reset_view()
+        elif changed and self._fit_mode:
+            self._fit_to_window()
+
+    def _has_image(self) -> bool:
+        return not self.pix_item.is_empty()
+
+    def _reset_view(self):
         self._rotation = 0.0
         self.pix_item.setRotation(self._rotation)
         self.view.resetTransform()
@@ -1158,7 +1449,7 @@ class ImageViewerDialog(QDialog):
         self._fit_to_window()
 
     def _zoom(self, factor: float):
-        if self.pix_item.pixmap().isNull():
+        if not self._has_image():
             return
         self._fit_mode = False
         if hasattr(self, "_act_fit") and self._act_fit is not None:
@@ -1170,7 +1461,7 @@ class ImageViewerDialog(QDialog):
         self._current_scale = new_scale
 
     def _rotate(self, delta_deg: float):
-        if self.pix_item.pixmap().isNull():
+        if not self._has_image():
             return
         self._rotation = (self._rotation + delta_deg) % 360
         self.pix_item.setRotation(self._rotation)
@@ -1178,7 +1469,7 @@ class ImageViewerDialog(QDialog):
             self._fit_to_window()
 
     def _reset(self):
-        if self.pix_item.pixmap().isNull():
+        if not self._has_image():
             return
         self._rotation = 0.0
         self.pix_item.setRotation(self._rotation)
@@ -1190,7 +1481,7 @@ class ImageViewerDialog(QDialog):
         self._fit_to_window()
 
     def _actual_size(self):
-        if self.pix_item.pixmap().isNull():
+        if not self._has_image():
             return
         self._fit_mode = False
         if hasattr(self, "_act_fit") and self._act_fit is not None:
@@ -1204,10 +1495,10 @@ class ImageViewerDialog(QDialog):
             self._fit_to_window()
 
     def _fit_to_window(self):
-        pm = self.pix_item.pixmap()
-        if pm.isNull():
+        if not self._has_image():
             return
-        br = QTransform().rotate(self._rotation).mapRect(QRectF(0, 0, pm.width(), pm.height()))
+        w, h = self.pix_item.image_size()
+        br = QTransform().rotate(self._rotation).mapRect(QRectF(0, 0, w, h))
         vw = max(1.0, self.view.viewport().width())
         vh = max(1.0, self.view.viewport().height())
         s = min(vw / br.width(), vh / br.height()) * 0.98
@@ -1247,15 +1538,139 @@ class ImageViewerDialog(QDialog):
         else:
             super().keyPressEvent(e)
 
+    def done(self, r):
+        self.tasks.shutdown()
+        super().done(r)
+
+
+class CaptureListModel(QAbstractListModel):
+    """
+    截图列表模型（配合 QListView 虚拟化显示）：
+    - 只持有路径列表；缩略图在视图请求可见行的 DecorationRole 时才异步加载
+    - 像素缓存交给 PixmapLRU（按字节限额），内存占用与总条数无关；
+      键为索引里的 (path, mtime, size)，由 set_keys() 在索引重新加载时整体替换；
+      data() 里只查字典、不 stat，截图被同名覆盖并重新对账后自动重新加载
+    """
+    def __init__(self, loader: ThumbLoader, pix_cache: PixmapLRU, placeholder: QPixmap, parent=None):
+        super().__init__(parent)
+        self.loader = loader
+        self.pix_cache = pix_cache
+        self.placeholder = placeholder
+        self._paths = []
+        self._rows = {}          # path -> row
+        self._keys = {}          # path -> 缓存键 (path, mtime, size)
+        self._pending = {}       # 已提交、尚未返回的 path -> 提交时的缓存键
+        self._failed = {}        # 解码失败的 path -> 失败时的缓存键（文件变了会重试）
+        self._tip = None         # 非 None 时只显示一行提示文字
+        self.badges = {}         # 代表图 path -> 折叠掉的近重复张数
+        loader.ready.connect(self._on_ready)
+
+    def set_paths(self, paths):
+        self.beginResetModel()
+        self.drop_pending()
+        self._paths = [str(p) for p in paths]
+        self._rows = {p: i for i, p in enumerate(self._paths)}
+        self._tip = None
+        self.endResetModel()
+
+    def set_keys(self, keys):
+        """索引重新加载后调用：keys 为 path -> (path, mtime, size)"""
+        self._keys = keys
+
+    def key_for(self, path: str):
+        return self._keys.get(path) or (path, 0.0, 0)
+
+    def set_tip(self, text: str):
+        self.beginResetModel()
+        self.drop_pending()
+        self._paths, self._rows = [], {}
+        self._tip = text
+        self.endResetModel()
+
+    def path_at(self, row: int):
+        return self._paths[row] if 0 <= row < len(self._paths) else None
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return 1 if self._tip is not None else len(self._paths)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if self._tip is not None:
+            return self._tip if role == Qt.DisplayRole else None
+        path = self.path_at(index.row())
+        if path is None:
+            return None
+        if role == Qt.DisplayRole:
+            name = os.path.basename(path)
+            if path in self.badges:
+                name += f"（+{self.badges[path]}）"
+            return "（无法加载）" + name if self._is_failed(path) else name
+        if role == Qt.UserRole:
+            return path
+        if role == Qt.DecorationRole:
+            key = self.key_for(path)
+            pix = self.pix_cache.get(key)
+            if pix is not None:
+                return pix
+            self._request(path, priority=1, key=key)
+            return self.placeholder
+        return None
+
+    def _is_failed(self, path: str, key=None) -> bool:
+        if path not in self._failed:
+            return False
+        return self._failed[path] == (key or self.key_for(path))
+
+    def _request(self, path: str, priority: int = 0, key=None):
+        key = key or self.key_for(path)
+        if path in self._pending or self._is_failed(path, key) or key in self.pix_cache:
+            return
+        self._pending[path] = key
+        self.loader.request(path, priority)
+
+    def prefetch(self, paths):
+        """低优先级预取（只暖缓存，不影响当前显示）"""
+        for p in paths:
+            self._request(str(p), priority=0)
+
+    def drop_pending(self):
+        """快速滚动/翻页后丢弃排队任务；仍可见的行会在重绘时重新请求"""
+        self.loader.cancel_all()
+        self._pending.clear()
+
+    def _on_ready(self, path: str, qimg: QImage, generation: int):
+        key = self._pending.pop(path, None) or self.key_for(path)
+        if qimg.isNull():
+            self._failed[path] = key
+            role = Qt.DisplayRole
+        else:
+            self._failed.pop(path, None)
+            self.pix_cache.put(key, QPixmap.fromImage(qimg))
+            role = Qt.DecorationRole
+        row = self._rows.get(path)
+        if row is not None:
+            idx = self.index(row)
+            self.dataChanged.emit(idx, idx, [role])
+
 
 class ImagePage(QWidget):
     """
-    图片浏览（分页版）
-    - 顶部：日期选择 + 查询
-    - 中部：缩略图网格（自适应每页数量）
-    - 底部：分页控件
+    图片浏览
+    - 顶部：日期选择 + 查询 + 检测类别/置信度筛选 + “折叠重复” / “清理重复” + “分页显示”开关
+      （类别筛选读截图时写入索引的检测元数据，浏览时不做推理）
+    - 中部：QListView + CaptureListModel 虚拟化网格（只为可见行加载缩略图，10 万张也能平滑滚动）
+    - 底部：分页控件（可选；勾选“分页显示”时启用，每页数量自适应）
     - 双击缩略图进入放大预览
+    缩略图三级缓存：内存 LRU（按字节限额）→ 磁盘缓存（路径+修改时间）→ 后台线程池解码；
+    未到达前显示占位图，并按翻页/滚动方向预取。
     """
+    THUMB_MEM_BYTES = 96 * 1024 * 1024
+    PREFETCH_PAGES = 1
+    ALARM_ONLY = "__alarm__"      # 类别下拉框里“仅报警截图”项的 data
+
     def __init__(self, parent=None, image_dir="captures"):
         super().__init__(parent)
         self.image_dir = image_dir
@@ -1265,6 +1680,26 @@ class ImagePage(QWidget):
         self.thumb_gap = 10
         self.page_size = 12
         self.page = 1
+        self.paged = False        # False：整列表虚拟滚动；True：旧的分页方式
+        self.collapse = False     # True：近重复截图每组只显示代表图（需先跑去重任务）
+        self._query_day = None    # 非 None：当前为按日期查询的结果
+        self._direction = 1       # 最近一次翻页/滚动方向：+1 向后 / -1 向前
+        self._last_scroll = 0
+
+        # 缩略图：内存 LRU + 磁盘缓存 + 线程池
+        self.pix_cache = PixmapLRU(self.THUMB_MEM_BYTES)
+        self.thumbs = ThumbLoader(
+            str(Path(writable_root()) / "cache" / "thumbs"),
+            (self.thumb_w, self.thumb_h), renderer=render_image_thumb, tag="image", parent=self
+        )
+        self._placeholder = QPixmap(self.thumb_w, self.thumb_h)
+        self._placeholder.fill(QColor("#c4c4c4"))
+        self.model = CaptureListModel(self.thumbs, self.pix_cache, self._placeholder, self)
+
+        # 截图索引：按时间有序，日期过滤是索引范围查找；目录被外部改动时才后台对账
+        self.index = get_capture_index()
+        self.tasks = BackgroundTasks(parent=self)
+        self.tasks.finished.connect(self._on_task_done)
 
         # 顶部 —— 日期 + 查询
         self.date_edit = QDateEdit(calendarPopup=True)
@@ -1272,22 +1707,50 @@ class ImagePage(QWidget):
         self.date_edit.setDate(QDate.currentDate())
         self.btn_query = QPushButton("查询")
         self.btn_query.setStyleSheet("background:#3a79ff;color:#fff;border-radius:8px;font-weight:600;height:34px;")
+        self.chk_paged = QCheckBox("分页显示")
+        self.cmb_class = QComboBox()
+        self.cmb_class.setMinimumWidth(150)
+        self.cmb_class.addItem("全部类别", None)
+        self.spin_conf = QDoubleSpinBox()
+        self.spin_conf.setRange(0.0, 1.0)
+        self.spin_conf.setSingleStep(0.05)
+        self.spin_conf.setDecimals(2)
+        self.spin_conf.setPrefix("置信度 ≥ ")
+        self.chk_collapse = QCheckBox("折叠重复")
+        self.btn_compact = QPushButton("清理重复")
+        self.btn_compact.setStyleSheet("background:#e0584b;color:#fff;border-radius:8px;font-weight:600;height:34px;")
 
         top = QHBoxLayout()
         top.addWidget(QLabel("选择日期："))
         top.addWidget(self.date_edit)
         top.addWidget(self.btn_query)
+        top.addSpacing(12)
+        top.addWidget(self.cmb_class)
+        top.addWidget(self.spin_conf)
         top.addStretch(1)
-
-        # 中部 —— 缩略图网格
-        self.grid = QListWidget()
-        self.grid.setViewMode(QListWidget.IconMode)
-        self.grid.setResizeMode(QListWidget.Adjust)
-        self.grid.setMovement(QListWidget.Static)
+        top.addWidget(self.chk_collapse)
+        top.addWidget(self.btn_compact)
+        top.addWidget(self.chk_paged)
+
+        # 中部 —— 缩略图网格（虚拟化：只绘制/加载可见行）
+        self.grid = QListView()
+        self.grid.setViewMode(QListView.IconMode)
+        self.grid.setResizeMode(QListView.Adjust)
+        self.grid.setMovement(QListView.Static)
         self.grid.setWrapping(True)
         self.grid.setSpacing(self.thumb_gap)
-        self.grid.setStyleSheet("QListWidget{background:#dcdcdc; border:1px solid #999; }")
+        self.grid.setUniformItemSizes(True)
+        self.grid.setVerticalScrollMode(QListView.ScrollPerPixel)
+        self.grid.setStyleSheet("QListView{background:#dcdcdc; border:1px solid #999; }")
         self.grid.setIconSize(QSize(self.thumb_w, self.thumb_h))
+        self.grid.setModel(self.model)
+
+        # 滚动停下后再加载：快速拖动时丢弃中途排队的缩略图任务
+        self._scroll_timer = QTimer(self)
+        self._scroll_timer.setSingleShot(True)
+        self._scroll_timer.setInterval(120)
+        self._scroll_timer.timeout.connect(self._on_scroll_settled)
+        self.grid.verticalScrollBar().valueChanged.connect(self._on_scroll)
 
         # 底部 —— 分页控件
         self.btn_prev = QPushButton("上一页")
@@ -1324,10 +1787,16 @@ class ImagePage(QWidget):
         self.btn_prev.clicked.connect(self.on_prev)
         self.btn_next.clicked.connect(self.on_next)
         self.btn_go.clicked.connect(self.on_jump)
-        self.grid.itemDoubleClicked.connect(self.on_open_viewer)
+        self.chk_paged.toggled.connect(self.set_paged)
+        self.chk_collapse.toggled.connect(self.set_collapse)
+        self.cmb_class.currentIndexChanged.connect(self.on_filter_changed)
+        self.spin_conf.valueChanged.connect(self.on_filter_changed)
+        self.btn_compact.clicked.connect(self.on_compact)
+        self.grid.doubleClicked.connect(self.on_open_viewer)
 
         # 自适应每页数
         self.page_size = self._calc_page_size()
+        self._update_pager_enabled()
 
     def _calc_page_size(self):
         gw = max(1, self.grid.viewport().width())
@@ -1335,48 +1804,132 @@ class ImagePage(QWidget):
         cols = max(2, gw // cell_w)
         return int(cols) * int(self.page_rows)
 
+    def set_paged(self, on: bool):
+        self.paged = bool(on)
+        self._update_pager_enabled()
+        if self.filtered:
+            self.page = 1
+            self._render_page()
+
+    def _update_pager_enabled(self):
+        for w in (self.page_edit, self.btn_go):
+            w.setEnabled(self.paged)
+        if not self.paged:
+            self.btn_prev.setEnabled(False)
+            self.btn_next.setEnabled(False)
+
     def resizeEvent(self, e):
         super().resizeEvent(e)
         new_size = self._calc_page_size()
         if new_size != self.page_size:
             self.page_size = new_size
-            if self.filtered:
+            if self.filtered and self.paged:
                 self._render_page()
 
     # 进入页面时调用
     def load_from_dir(self, dir_path=None):
         if dir_path is not None:
             self.image_dir = dir_path
-        self.grid.clear()
 
         if not os.path.isdir(self.image_dir):
-            self.grid.addItem(QListWidgetItem("图片目录不存在：" + self.image_dir))
-            self.page_info.setText("第 0 / 0 页")
+            self._show_tip("图片目录不存在：" + self.image_dir)
             return
 
-        exts = (".jpg", ".jpeg", ".png", ".bmp")
-        files = [os.path.join(self.image_dir, f) for f in os.listdir(self.image_dir) if f.lower().endswith(exts)]
-        files.sort(key=lambda p: os.path.getmtime(p), reverse=True)
+        if self.index.needs_sync(self.image_dir):
+            # 首次使用或目录被外部改动：后台对账完成后再显示
+            self._show_tip("正在建立图片索引…")
+            self.tasks.submit("sync", self.index.sync, self.image_dir)
+            return
+        self._load_index()
 
-        MAX_SCAN = 2000
-        if len(files) > MAX_SCAN:
-            files = files[:MAX_SCAN]
+    def _on_task_done(self, name: str, result):
+        if name == "sync":
+            if self.collapse:
+                self._run_dedup()  # 目录有新截图：顺带补算哈希、更新分组
+            else:
+                self._load_index()
+        elif name in ("dedup", "compact"):
+            self.chk_collapse.setEnabled(True)
+            self.btn_compact.setEnabled(True)
+            if result is not None:
+                print("[ImagePage] 去重：", format_report(result).replace("\n", "；"))
+                if name == "compact":
+                    QMessageBox.information(self, "清理重复", format_report(result))
+            self._load_index()
+
+    # 近重复：哈希与分组都在后台任务里算，完成后按索引重新加载
+    def _run_dedup(self, compact: bool = False):
+        self.chk_collapse.setEnabled(False)
+        self.btn_compact.setEnabled(False)
+        self.tasks.submit("compact" if compact else "dedup", dedup_captures,
+                          self.index, self.image_dir, compact=compact)
+
+    def set_collapse(self, on: bool):
+        self.collapse = bool(on)
+        if self.collapse and os.path.isdir(self.image_dir):
+            self._run_dedup()  # 只为新增截图补算哈希，已算过的直接复用
+        else:
+            self._load_index()
 
-        self.all_files = files
-        self.filtered = self.all_files
+    def on_compact(self):
+        if not os.path.isdir(self.image_dir):
+            return
+        ret = QMessageBox.question(
+            self, "清理重复",
+            "将删除每组近重复截图中除最早一张以外的文件，且无法恢复。\n是否继续？",
+            QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        if ret == QMessageBox.Yes:
+            self._run_dedup(compact=True)
+
+    # 检测元数据筛选（类别 / 置信度 / 仅报警）
+    def _filter_kwargs(self) -> dict:
+        data = self.cmb_class.currentData()
+        return dict(collapse=self.collapse,
+                    cls=None if data in (None, self.ALARM_ONLY) else data,
+                    min_conf=float(self.spin_conf.value()),
+                    alarm_only=data == self.ALARM_ONLY)
+
+    def _has_filter(self) -> bool:
+        return self.cmb_class.currentData() is not None or self.spin_conf.value() > 0
+
+    def _refresh_classes(self):
+        """按索引里出现过的类别重建下拉框，尽量保留当前选择"""
+        cur = self.cmb_class.currentData()
+        self.cmb_class.blockSignals(True)
+        self.cmb_class.clear()
+        self.cmb_class.addItem("全部类别", None)
+        self.cmb_class.addItem("仅报警截图", self.ALARM_ONLY)
+        for cls, n in self.index.detection_classes(self.image_dir):
+            self.cmb_class.addItem(f"{cls}（{n}）", cls)
+        i = self.cmb_class.findData(cur)
+        self.cmb_class.setCurrentIndex(i if i >= 0 else 0)
+        self.cmb_class.blockSignals(False)
+
+    def on_filter_changed(self, *_):
+        if self._query_day is not None:
+            self._run_date_query(self._query_day)
+        else:
+            self._load_index()
+
+    def _load_index(self):
+        self._query_day = None
+        self._refresh_classes()
+        self.all_files = self.index.all_paths(self.image_dir, collapse=self.collapse)
+        self.model.badges = self.index.dup_counts(self.image_dir) if self.collapse else {}
+        self.model.set_keys(self.index.file_keys(self.image_dir))
+        self.filtered = (self.index.all_paths(self.image_dir, **self._filter_kwargs())
+                         if self._has_filter() else self.all_files)
         self.page = 1
 
         if not self.filtered:
-            self.grid.addItem(QListWidgetItem("未找到任何图片。"))
-            self.page_info.setText("第 0 / 0 页")
+            self._show_tip("没有符合筛选条件的图片。" if self.all_files else "未找到任何图片。")
             return
 
         self.page_size = self._calc_page_size()
         self._render_page()
 
     def _show_tip(self, text):
-        self.grid.clear()
-        self.grid.addItem(QListWidgetItem(text))
+        self.model.set_tip(text)
         self.page_info.setText("第 0 / 0 页")
 
     # 查询（按日期过滤）
@@ -1384,54 +1937,84 @@ class ImagePage(QWidget):
         if not self.all_files:
             self._show_tip("目录为空或尚未加载。")
             return
-        target = self.date_edit.date().toPyDate()
-        self.filtered = [p for p in self.all_files if _file_mdate(p) == target]
+        self._run_date_query(self.date_edit.date().toPyDate())
+
+    def _run_date_query(self, target):
+        self._query_day = target
+        self.filtered = self.index.query_date(self.image_dir, target, **self._filter_kwargs())
         self.page = 1
         if not self.filtered:
-            self._show_tip(f"所选日期（{target}）无图片。")
+            hint = "（已启用类别/置信度筛选）" if self._has_filter() else ""
+            self._show_tip(f"所选日期（{target}）无图片。{hint}")
             return
         self.page_size = self._calc_page_size()
         self._render_page()
 
-    # 渲染当前页
+    # 刷新模型（不解码：可见行由视图按需向模型要缩略图）
     def _render_page(self):
         total = len(self.filtered)
+        if not self.paged:
+            self.model.set_paths(self.filtered)
+            self.grid.scrollToTop()
+            self._last_scroll = 0
+            self.page_info.setText(f"共 {total} 张")
+            return
+
         pages = max(1, math.ceil(total / self.page_size))
         self.page = max(1, min(self.page, pages))
         self.page_info.setText(f"第 {self.page} / {pages} 页")
 
-        self.grid.clear()
         start = (self.page - 1) * self.page_size
         end = min(total, start + self.page_size)
+        self.model.set_paths(self.filtered[start:end])
 
-        THUMB_W, THUMB_H = self.thumb_w, self.thumb_h
-
-        for path in self.filtered[start:end]:
-            reader = QImageReader(path)
-            reader.setAutoTransform(True)
-            reader.setScaledSize(QSize(THUMB_W, THUMB_H))
-            img = reader.read()
-            if img.isNull():
-                continue
-            icon = QPixmap.fromImage(img)
-
-            it = QListWidgetItem(QIcon(icon), os.path.basename(path))
-            it.setFlags(it.flags() | Qt.ItemIsSelectable | Qt.ItemIsEnabled)
-            it.setData(Qt.UserRole, str(path))
-            self.grid.addItem(it)
+        # 按翻页方向预取（低优先级，只暖缓存）
+        for k in range(1, self.PREFETCH_PAGES + 1):
+            p = self.page + self._direction * k
+            if not 1 <= p <= pages:
+                break
+            s0 = (p - 1) * self.page_size
+            self.model.prefetch(self.filtered[s0:s0 + self.page_size])
 
         self.btn_prev.setEnabled(self.page > 1)
         self.btn_next.setEnabled(self.page < pages)
 
+    # 连续滚动模式：滚动停下后只加载可见行，并按滚动方向预取一屏
+    def _on_scroll(self, value: int):
+        self._direction = 1 if value >= self._last_scroll else -1
+        self._last_scroll = value
+        self._scroll_timer.start()
+
+    def _on_scroll_settled(self):
+        if self.paged:
+            return
+        self.model.drop_pending()
+        self.grid.viewport().update()  # 重绘时视图会为可见行重新请求缩略图
+        vp = self.grid.viewport().rect()
+        first = self.grid.indexAt(vp.topLeft())
+        last = self.grid.indexAt(vp.bottomRight())
+        if not first.isValid():
+            return
+        r0 = first.row()
+        r1 = last.row() if last.isValid() else min(len(self.filtered) - 1, r0 + self.page_size)
+        span = max(1, r1 - r0 + 1)
+        if self._direction > 0:
+            rows = range(r1 + 1, min(len(self.filtered), r1 + 1 + span))
+        else:
+            rows = range(max(0, r0 - span), r0)
+        self.model.prefetch(self.model.path_at(r) for r in rows)
+
     def on_prev(self):
         if self.page > 1:
             self.page -= 1
+            self._direction = -1
             self._render_page()
 
     def on_next(self):
         pages = max(1, math.ceil(len(self.filtered) / self.page_size))
         if self.page < pages:
             self.page += 1
+            self._direction = 1
             self._render_page()
 
     def on_jump(self):
@@ -1442,21 +2025,22 @@ class ImagePage(QWidget):
         p = int(text)
         pages = max(1, math.ceil(len(self.filtered) / self.page_size))
         if 1 <= p <= pages:
+            self._direction = 1 if p >= self.page else -1
             self.page = p
             self._render_page()
         else:
             QMessageBox.information(self, "提示", f"页码范围：1 ~ {pages}")
 
     # 双击放大
-    def on_open_viewer(self, item: QListWidgetItem = None):
+    def on_open_viewer(self, index: QModelIndex = None):
         try:
-            if item is None:
-                item = self.grid.currentItem()
-            if item is None:
+            if index is None or not index.isValid():
+                index = self.grid.currentIndex()
+            if not index.isValid():
                 QMessageBox.information(self, "提示", "没有选中任何图片项。")
                 return
 
-            path = item.data(Qt.UserRole)
+            path = index.data(Qt.UserRole)
             if not path:
                 QMessageBox.information(self, "提示", "该项未保存图片路径。")
                 return
@@ -1465,19 +2049,8 @@ class ImagePage(QWidget):
                 QMessageBox.information(self, "提示", f"文件不存在：\n{path}")
                 return
 
-            reader = QImageReader(path)
-            reader.setAutoTransform(True)
-            img = reader.read()
-            if img.isNull():
-                QMessageBox.warning(self, "提示", "无法加载图片。")
-                return
-
-            MAX_SIDE = 6000
-            if img.width() > MAX_SIDE or img.height() > MAX_SIDE:
-                img = img.scaled(MAX_SIDE, MAX_SIDE, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-
-            pix = QPixmap.fromImage(img)
-            dlg = ImageViewerDialog(pix, self)
+            # 原图解码和金字塔构建都在对话框的后台线程里完成，先用列表缩略图占位
+            dlg = ImageViewerDialog(path, self, preview=self.pix_cache.get(self.model.key_for(path)))
             dlg.resize(900, 600)
             dlg.exec_()  # PyQt5: exec_；若为 PyQt6 请改为 exec()
         except Exception as e:
@@ -1488,7 +2061,7 @@ class ImagePage(QWidget):
         new_size = self._calc_page_size()
         if new_size != self.page_size:
             self.page_size = new_size
-            if self.filtered:
+            if self.filtered and self.paged:
                 self._render_page()
 
 
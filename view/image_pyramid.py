@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+image_pyramid.py
+大图预览用的图像金字塔 + 分块绘制
+- build_pyramid()：在工作线程里解码一次原图，逐级 1/2 缩小生成各层 QImage（总内存约为原图的 4/3）；
+  建层前按 MAX_SIDE 与 PYRAMID_MAX_BYTES 估算占用，超出则按比例缩小解码
+- TiledImageItem：QGraphicsItem，按当前缩放倍率选层，只绘制视口内可见的 TILE×TILE 分块；
+  分块 QPixmap 放在按字节限额的 PixmapLRU 里，缩放/平移/旋转时不再整图重采样
+"""
+import math
+from typing import List, Optional, Tuple
+
+from PyQt5.QtCore import Qt, QRectF, QSize
+from PyQt5.QtGui import QImage, QImageReader, QPixmap, QPainter
+from PyQt5.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
+
+try:
+    from .thumb_cache import PixmapLRU
+except ImportError:
+    from thumb_cache import PixmapLRU
+
+
+TILE = 256            # 分块边长（像素，各层相同）
+MAX_SIDE = 6000       # 原图最长边上限（超出按比例缩小解码，防止超大图占满内存）
+PYRAMID_MAX_BYTES = 160 * 1024 * 1024  # 整个金字塔（ARGB32，各层合计约 4/3 原图）的内存上限
+
+
+class ImagePyramid:
+    """levels[0] 为原图，levels[k] 约为原图的 1/2^k；最顶层最长边不超过 TILE"""
+    def __init__(self, levels: List[QImage]):
+        self.levels = levels
+        self.width = levels[0].width()
+        self.height = levels[0].height()
+
+    def __len__(self) -> int:
+        return len(self.levels)
+
+    def level_for_scale(self, scale: float) -> int:
+        """屏幕上 1 个原图像素对应 scale 个设备像素：选不小于所需分辨率的最粗一层"""
+        if scale <= 0:
+            return len(self.levels) - 1
+        k = int(math.floor(math.log2(1.0 / scale))) if scale < 1.0 else 0
+        return max(0, min(len(self.levels) - 1, k))
+
+    def factor(self, level: int) -> Tuple[float, float]:
+        """该层 1 像素对应原图多少像素（x, y）"""
+        img = self.levels[level]
+        return self.width / img.width(), self.height / img.height()
+
+    def tile(self, level: int, tx: int, ty: int) -> QImage:
+        img = self.levels[level]
+        return img.copy(tx * TILE, ty * TILE,
+                        min(TILE, img.width() - tx * TILE), min(TILE, img.height() - ty * TILE))
+
+
+def pyramid_bytes(w: int, h: int) -> int:
+    """w×h 原图建成金字塔后的大致字节数（ARGB32 每像素 4 字节，各层合计约 4/3）"""
+    return int(w) * int(h) * 4 * 4 // 3
+
+
+def _fit_scale(w: int, h: int) -> float:
+    """满足 MAX_SIDE 与 PYRAMID_MAX_BYTES 所需的缩放比例（≤1）"""
+    if w <= 0 or h <= 0:
+        return 1.0
+    s = min(1.0, MAX_SIDE / max(w, h))
+    need = pyramid_bytes(w * s, h * s)
+    if need > PYRAMID_MAX_BYTES:
+        s *= math.sqrt(PYRAMID_MAX_BYTES / need)
+    return s
+
+
+def _read_image(path: str) -> Optional[QImage]:
+    reader = QImageReader(path)
+    reader.setAutoTransform(True)
+    src = reader.size()
+    if src.isValid():
+        s = _fit_scale(src.width(), src.height())
+        if s < 1.0:  # 解码时直接缩小，原尺寸位图从不进内存
+            reader.setScaledSize(QSize(max(1, int(src.width() * s)), max(1, int(src.height() * s))))
+    img = reader.read()
+    return None if img.isNull() else img
+
+
+def build_pyramid(source) -> Optional[ImagePyramid]:
+    """
+    source 可以是文件路径或 QImage。只用 QImage（可在工作线程中使用），不碰 QPixmap。
+    失败返回 None。
+    """
+    img = _read_image(source) if isinstance(source, str) else source
+    if img is None or img.isNull():
+        return None
+    s = _fit_scale(img.width(), img.height())  # 传入的 QImage（或读不到尺寸的文件）同样受限
+    if s < 1.0:
+        img = img.scaled(max(1, int(img.width() * s)), max(1, int(img.height() * s)),
+                         Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+    img = img.convertToFormat(QImage.Format_ARGB32_Premultiplied)  # 绘制最快的格式
+    levels = [img]
+    while max(levels[-1].width(), levels[-1].height()) > TILE:
+        prev = levels[-1]
+        levels.append(prev.scaled(max(1, prev.width() // 2), max(1, prev.height() // 2),
+                                  Qt.IgnoreAspectRatio, Qt.SmoothTransformation))
+    return ImagePyramid(levels)
+
+
+class TiledImageItem(QGraphicsItem):
+    """
+    以原点为中心的图像项（尺寸始终为原图尺寸，便于适配窗口/旋转）
+    - 金字塔未就绪时绘制 preview（例如列表里的缩略图）拉伸到整幅
+    - 就绪后只绘制 exposedRect 覆盖到的分块
+    """
+    TILE_CACHE_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)  # 提供 exposedRect
+        self.pyramid: Optional[ImagePyramid] = None
+        self.preview: Optional[QPixmap] = None
+        self._w, self._h = 0, 0
+        self.tiles = PixmapLRU(self.TILE_CACHE_BYTES)
+
+    # ---------- 数据 ----------
+    def image_size(self) -> Tuple[int, int]:
+        return self._w, self._h
+
+    def is_empty(self) -> bool:
+        return self._w <= 0 or self._h <= 0
+
+    def _resize(self, w: int, h: int):
+        if (w, h) != (self._w, self._h):
+            self.prepareGeometryChange()
+            self._w, self._h = int(w), int(h)
+
+    def set_preview(self, pix: QPixmap, size: Tuple[int, int] = None):
+        self.preview = pix if pix is not None and not pix.isNull() else None
+        if size is not None:
+            self._resize(*size)
+        elif self.preview is not None and self.is_empty():
+            self._resize(self.preview.width(), self.preview.height())
+        self.update()
+
+    def set_pyramid(self, pyramid: ImagePyramid):
+        self.pyramid = pyramid
+        self.tiles.clear()
+        self._resize(pyramid.width, pyramid.height)
+        self.update()
+
+    # ---------- QGraphicsItem ----------
+    def boundingRect(self) -> QRectF:
+        return QRectF(-self._w / 2, -self._h / 2, self._w, self._h)
+
+    def paint(self, painter: QPainter, option: QStyleOptionGraphicsItem, widget=None):
+        if self.is_empty():
+            return
+        rect = self.boundingRect()
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, True)
+        pyr = self.pyramid
+        if pyr is None:
+            if self.preview is not None:
+                painter.drawPixmap(rect, self.preview, QRectF(self.preview.rect()))
+            return
+
+        scale = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        level = pyr.level_for_scale(scale)
+        fx, fy = pyr.factor(level)
+        lw, lh = pyr.levels[level].width(), pyr.levels[level].height()
+
+        # 可见区域（item 坐标）→ 该层像素坐标 → 分块下标范围
+        vis = option.exposedRect.intersected(rect)
+        if vis.isEmpty():
+            return
+        x0 = (vis.left() - rect.left()) / fx
+        y0 = (vis.top() - rect.top()) / fy
+        x1 = (vis.right() - rect.left()) / fx
+        y1 = (vis.bottom() - rect.top()) / fy
+        tx0, ty0 = max(0, int(x0 // TILE)), max(0, int(y0 // TILE))
+        tx1 = min((lw - 1) // TILE, int(x1 // TILE))
+        ty1 = min((lh - 1) // TILE, int(y1 // TILE))
+
+        for ty in range(ty0, ty1 + 1):
+            for tx in range(tx0, tx1 + 1):
+                key = f"{level}:{tx}:{ty}"
+                pix = self.tiles.get(key)
+                if pix is None:
+                    pix = QPixmap.fromImage(pyr.tile(level, tx, ty))
+                    self.tiles.put(key, pix)
+                target = QRectF(rect.left() + tx * TILE * fx, rect.top() + ty * TILE * fy,
+                                pix.width() * fx, pix.height() * fy)
+                painter.drawPixmap(target, pix, QRectF(pix.rect()))
@@ -0,0 +1,518 @@
+# -*- coding: utf-8 -*-
+"""
+media_index.py
+录像 / 截图目录的持久化索引（SQLite）：按日期查询只查索引，不再遍历目录
+- RecordingIndex：摄像头片段关闭时直接写入一条记录（record）；
+  目录有变化时由 sync() 增量对账：只探测新增/变化的文件，删除已消失的记录
+- CaptureIndex：截图写入方（摄像头/视频页）保存后直接 add()；
+  按 mtime 建 B-tree 索引，按日期过滤是一次范围查找，没有数量上限；
+  另存感知哈希（dhash）与近重复分组（dup_of），供图片页折叠重复（见 dedup.py）；
+  截图时的检测结果（框/类别/置信度/报警状态）写入 detections 表，浏览时按类别筛选无需再推理
+"""
+import datetime
+import os
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+
+VIDEO_EXTS = (".mp4", ".avi", ".mkv", ".mov")
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+
+# 片段文件名：2025-12-02_22-49-20.mp4（CameraPage._open_new_segment 的命名规则）
+_NAME_TS = re.compile(r"^(\d{4}-\d{2}-\d{2})_(\d{2})-(\d{2})-(\d{2})")
+
+
+def parse_name_ts(name: str) -> Optional[datetime.datetime]:
+    m = _NAME_TS.match(name)
+    if not m:
+        return None
+    try:
+        return datetime.datetime.strptime(
+            f"{m.group(1)} {m.group(2)}:{m.group(3)}:{m.group(4)}", "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def probe_video(path: str) -> Dict:
+    """用 OpenCV 读容器头信息（不解码帧）：fps / 帧数 / 分辨率"""
+    cap = cv2.VideoCapture(path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        frames = cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0.0
+        w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 0)
+        h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT) or 0)
+    finally:
+        cap.release()
+    duration = frames / fps if fps > 1e-3 and frames > 0 else None
+    return {"fps": fps or None, "width": w or None, "height": h or None, "duration_s": duration}
+
+
+class RecordingIndex:
+    """
+    录像目录索引：
+      recordings(path, name, name_date, mtime_date, start_ts, duration_s, fps,
+                 width, height, size, mtime_ns, events)
+    线程安全（单连接 + 锁），可在 GUI 线程写入、后台线程对账。
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS recordings(
+            path        TEXT PRIMARY KEY,
+            name        TEXT NOT NULL,
+            name_date   TEXT,
+            mtime_date  TEXT,
+            start_ts    REAL,
+            duration_s  REAL,
+            fps         REAL,
+            width       INTEGER,
+            height      INTEGER,
+            size        INTEGER,
+            mtime_ns    INTEGER,
+            events      INTEGER DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_rec_name_date  ON recordings(name_date);
+        CREATE INDEX IF NOT EXISTS idx_rec_mtime_date ON recordings(mtime_date);
+    """
+
+    def __init__(self, db_path: str, video_dir: str):
+        self.db_path = str(db_path)
+        self.video_dir = str(video_dir)
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(self.SCHEMA)
+        self._db.commit()
+
+    # ---------- 写入 ----------
+    def _row(self, path: str, st: os.stat_result, meta: Dict, events: int) -> Tuple:
+        name = os.path.basename(path)
+        ts = parse_name_ts(name)
+        mtime = st.st_mtime
+        duration = meta.get("duration_s")
+        if ts is not None:
+            start_ts = ts.timestamp()
+        else:
+            start_ts = mtime - duration if duration else mtime
+        return (
+            path, name,
+            ts.date().isoformat() if ts else None,
+            datetime.date.fromtimestamp(mtime).isoformat(),
+            start_ts, duration, meta.get("fps"), meta.get("width"), meta.get("height"),
+            st.st_size, st.st_mtime_ns, int(events),
+        )
+
+    def _upsert(self, rows: List[Tuple]):
+        if not rows:
+            return
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO recordings VALUES (?,?,?,?,?,?,?,?,?,?,?,?)", rows)
+            self._db.commit()
+
+    def record(self, path: str, fps: float = None, size: Tuple[int, int] = None,
+               frames: int = None, events: int = 0):
+        """片段写完后调用：已知的元数据直接入库，缺的再探测"""
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        if fps and size and frames is not None:
+            meta = {"fps": float(fps), "width": int(size[0]), "height": int(size[1]),
+                    "duration_s": frames / float(fps)}
+        else:
+            meta = probe_video(path)
+        self._upsert([self._row(path, st, meta, events)])
+
+    # ---------- 增量对账 ----------
+    def sync(self) -> Tuple[int, int]:
+        """
+        与磁盘对账：新增/变化（size 或 mtime 不同）的文件重新探测，已删除的移出索引。
+        返回 (新增或更新数, 删除数)。
+        """
+        with self._lock:
+            known = {p: (sz, mt, ev) for p, sz, mt, ev in
+                     self._db.execute("SELECT path, size, mtime_ns, events FROM recordings")}
+
+        seen, rows = set(), []
+        try:
+            entries = list(os.scandir(self.video_dir))
+        except OSError:
+            entries = []
+        for e in entries:
+            if not e.is_file() or not e.name.lower().endswith(VIDEO_EXTS):
+                continue
+            path = os.path.abspath(e.path)
+            seen.add(path)
+            try:
+                st = e.stat()
+            except OSError:
+                continue
+            old = known.get(path)
+            if old is not None and old[0] == st.st_size and old[1] == st.st_mtime_ns:
+                continue
+            rows.append(self._row(path, st, probe_video(path), old[2] if old else 0))
+        self._upsert(rows)
+
+        gone = [p for p in known if p not in seen]
+        if gone:
+            with self._lock:
+                self._db.executemany("DELETE FROM recordings WHERE path=?", [(p,) for p in gone])
+                self._db.commit()
+        return len(rows), len(gone)
+
+    # ---------- 查询 ----------
+    def query_date(self, d: datetime.date) -> List[str]:
+        """文件名日期或修改日期等于 d 的录像（按路径排序，与旧的目录遍历结果一致）"""
+        iso = d.isoformat()
+        with self._lock:
+            cur = self._db.execute(
+                "SELECT path FROM recordings WHERE name_date=? OR mtime_date=? ORDER BY path",
+                (iso, iso))
+            return [r[0] for r in cur]
+
+    def get(self, path: str) -> Optional[Dict]:
+        with self._lock:
+            cur = self._db.execute("SELECT * FROM recordings WHERE path=?", (os.path.abspath(path),))
+            row = cur.fetchone()
+            cols = [c[0] for c in cur.description]
+        return dict(zip(cols, row)) if row else None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def capture_source(name: str) -> str:
+    """按截图文件名前缀推断来源"""
+    n = name.lower()
+    if n.startswith("auto_"):
+        return "camera_auto"
+    if n.startswith("photo_"):
+        return "camera"
+    if n.startswith("video1_detect_"):
+        return "video1"
+    if n.startswith(("shot_", "video_")):
+        return "video"
+    return "other"
+
+
+class CaptureIndex:
+    """
+    截图索引：captures(path, dir, name, mtime, size, source, dhash, dup_of)，(dir, mtime) 上建索引。
+    目录 mtime 记在 meta 表里：目录未变化时 sync() 直接返回，不再 listdir/stat。
+    dhash 为 64 位差值哈希（按有符号 INTEGER 存）；无法解码的图 dhash 为 NULL、hash_failed=1，
+    不参与分组也不会被清理。dup_of 非空表示该图是 dup_of 的近重复。
+    文件内容变化（重新写入）时两列都会清空，等下一次去重任务重新计算。
+    检测元数据：captures.alarm / det_ts（产生该截图那一帧的报警状态与时间戳），
+    detections(path, cls, cls_id, conf, x1, y1, x2, y2) 每个框一行，(cls, conf) 上建索引。
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS captures(
+            path    TEXT PRIMARY KEY,
+            dir     TEXT NOT NULL,
+            name    TEXT NOT NULL,
+            mtime   REAL NOT NULL,
+            size    INTEGER,
+            source  TEXT,
+            dhash   INTEGER,
+            hash_failed INTEGER,
+            dup_of  TEXT,
+            alarm   INTEGER,
+            det_ts  REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_cap_dir_mtime ON captures(dir, mtime);
+        CREATE TABLE IF NOT EXISTS detections(
+            path    TEXT NOT NULL,
+            cls     TEXT NOT NULL,
+            cls_id  INTEGER,
+            conf    REAL NOT NULL,
+            x1 REAL, y1 REAL, x2 REAL, y2 REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_det_path ON detections(path);
+        CREATE INDEX IF NOT EXISTS idx_det_cls_conf ON detections(cls, conf);
+        CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY, value TEXT);
+    """
+    _UPSERT = ("INSERT OR REPLACE INTO captures(path, dir, name, mtime, size, source) "
+               "VALUES (?,?,?,?,?,?)")
+
+    def __init__(self, db_path: str):
+        self.db_path = str(db_path)
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(self.SCHEMA)
+        self._migrate()
+        self._db.commit()
+
+    def _migrate(self):
+        """旧版数据库（缺少 dhash/hash_failed/dup_of/alarm/det_ts 列）原地补列"""
+        cols = {r[1] for r in self._db.execute("PRAGMA table_info(captures)")}
+        for col, decl in (("dhash", "INTEGER"), ("hash_failed", "INTEGER"), ("dup_of", "TEXT"),
+                          ("alarm", "INTEGER"), ("det_ts", "REAL")):
+            if col not in cols:
+                self._db.execute(f"ALTER TABLE captures ADD COLUMN {col} {decl}")
+        if "dhash" in cols and "hash_failed" not in cols:
+            # 旧版把解码失败记成 dhash=0，与真实的全 0 哈希无法区分：清空重算，解散相关分组
+            self._db.execute("UPDATE captures SET dup_of=NULL WHERE dup_of IN "
+                             "(SELECT path FROM captures WHERE dhash=0)")
+            self._db.execute("UPDATE captures SET dhash=NULL, dup_of=NULL WHERE dhash=0")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_cap_dup ON captures(dup_of)")
+
+    @staticmethod
+    def _dir_key(d: str) -> str:
+        return "dir_mtime_ns:" + os.path.abspath(d)
+
+    @staticmethod
+    def dir_mtime(d: str) -> Optional[int]:
+        """写入截图前调用并把结果传给 add(dir_mtime_before=...)，见 add()"""
+        try:
+            return os.stat(d).st_mtime_ns
+        except OSError:
+            return None
+
+    def _stored_dir_mtime(self, d: str) -> Optional[str]:
+        row = self._db.execute("SELECT value FROM meta WHERE key=?", (self._dir_key(d),)).fetchone()
+        return row[0] if row else None
+
+    def _set_dir_mtime(self, d: str, mtime_ns: Optional[int]):
+        if mtime_ns is None:
+            return
+        self._db.execute("INSERT OR REPLACE INTO meta VALUES (?,?)", (self._dir_key(d), str(mtime_ns)))
+
+    # ---------- 写入（由截图写入方调用） ----------
+    def add(self, path: str, source: str = None, detections: List[Tuple] = None,
+            alarm: Optional[bool] = None, det_ts: Optional[float] = None,
+            dir_mtime_before: Optional[int] = None):
+        """
+        detections：[(cls, cls_id, conf, (x1, y1, x2, y2))]，为 None 表示没有检测信息（与“检测为空”[] 区分）
+        alarm / det_ts：产生该截图那一帧的报警状态与时间戳
+        dir_mtime_before：写文件前的 dir_mtime()。只有它等于已记录的对账 mtime（目录此前已同步、
+        期间只有这次写入）时才把对账 mtime 推进到当前值；否则保持过期，下次 sync() 整目录对账，
+        不会把从未索引过的旧截图或外部改动“标记为已同步”
+        """
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        d, name = os.path.split(path)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO captures(path, dir, name, mtime, size, source, alarm, det_ts) "
+                "VALUES (?,?,?,?,?,?,?,?)",
+                (path, d, name, st.st_mtime, st.st_size, source or capture_source(name),
+                 None if alarm is None else int(bool(alarm)), det_ts))
+            self._db.execute("DELETE FROM detections WHERE path=?", (path,))
+            if detections:
+                self._db.executemany(
+                    "INSERT INTO detections VALUES (?,?,?,?,?,?,?,?)",
+                    [(path, str(c), None if cid is None else int(cid), float(conf), *map(float, box))
+                     for c, cid, conf, box in detections])
+            # 目录此前已同步且只多了这次写入：无需重新对账
+            if dir_mtime_before is not None and self._stored_dir_mtime(d) == str(dir_mtime_before):
+                self._set_dir_mtime(d, self.dir_mtime(d))
+            self._db.commit()
+
+    def remove(self, paths: List[str]):
+        with self._lock:
+            self._delete([(os.path.abspath(p),) for p in paths])
+            self._db.commit()
+
+    def _delete(self, rows: List[Tuple[str]]):
+        """删除记录；以被删图为代表的近重复重新显示出来（调用方持锁）"""
+        self._db.executemany("DELETE FROM captures WHERE path=?", rows)
+        self._db.executemany("DELETE FROM detections WHERE path=?", rows)
+        self._db.executemany("UPDATE captures SET dup_of=NULL WHERE dup_of=?", rows)
+
+    # ---------- 对账 ----------
+    def needs_sync(self, d: str) -> bool:
+        cur = self.dir_mtime(d)
+        with self._lock:
+            stored = self._stored_dir_mtime(d)
+        return cur is not None and stored != str(cur)
+
+    def sync(self, d: str) -> Tuple[int, int]:
+        """目录在外部被改动过（首次使用 / 手动拷入删除）时才整目录对账"""
+        d = os.path.abspath(d)
+        if not self.needs_sync(d):
+            return 0, 0
+        dir_mtime = self.dir_mtime(d)
+        with self._lock:
+            known = {p: (mt, sz) for p, mt, sz in
+                     self._db.execute("SELECT path, mtime, size FROM captures WHERE dir=?", (d,))}
+        rows, seen = [], set()
+        try:
+            entries = list(os.scandir(d))
+        except OSError:
+            entries = []
+        for e in entries:
+            if not e.is_file() or not e.name.lower().endswith(IMAGE_EXTS):
+                continue
+            path = os.path.abspath(e.path)
+            seen.add(path)
+            try:
+                st = e.stat()
+            except OSError:
+                continue
+            if known.get(path) == (st.st_mtime, st.st_size):
+                continue
+            rows.append((path, d, e.name, st.st_mtime, st.st_size, capture_source(e.name)))
+        gone = [(p,) for p in known if p not in seen]
+        with self._lock:
+            if rows:
+                # 外部改动过的文件：旧的检测元数据已不对应当前内容
+                self._db.executemany(self._UPSERT, rows)
+                self._db.executemany("DELETE FROM detections WHERE path=?", [(r[0],) for r in rows])
+            if gone:
+                self._delete(gone)
+            self._set_dir_mtime(d, dir_mtime)
+            self._db.commit()
+        return len(rows), len(gone)
+
+    # ---------- 感知哈希 / 近重复分组（由 dedup.py 的后台任务写入） ----------
+    def unhashed(self, d: str) -> List[str]:
+        with self._lock:
+            cur = self._db.execute(
+                "SELECT path FROM captures WHERE dir=? AND dhash IS NULL AND hash_failed IS NULL ORDER BY mtime",
+                (os.path.abspath(d),))
+            return [r[0] for r in cur]
+
+    def set_hashes(self, items: List[Tuple[str, Optional[int]]]):
+        """items: [(path, 有符号 64 位 dhash 或 None（无法解码，记 hash_failed，文件内容变化前不再重试）)]"""
+        with self._lock:
+            self._db.executemany("UPDATE captures SET dhash=?, hash_failed=? WHERE path=?",
+                                 [(h, None if h is not None else 1, p) for p, h in items])
+            self._db.commit()
+
+    def hashes(self, d: str) -> List[Tuple[str, int, float, int, int]]:
+        """
+        [(path, dhash, mtime, size, protected)]，按时间正序；只含已算过哈希的
+        protected=1：截图时处于报警状态或存有检测框（去重时优先作代表图、清理时不删）
+        """
+        with self._lock:
+            cur = self._db.execute(
+                "SELECT path, dhash, mtime, size, "
+                "(IFNULL(alarm, 0)=1 OR EXISTS(SELECT 1 FROM detections t WHERE t.path=captures.path)) "
+                "FROM captures WHERE dir=? AND dhash IS NOT NULL ORDER BY mtime",
+                (os.path.abspath(d),))
+            return list(cur)
+
+    def set_groups(self, d: str, dup_of: Dict[str, str]):
+        """整目录重写分组：dup_of[path] = 代表图路径；不在字典里的视为代表/独立图"""
+        with self._lock:
+            self._db.execute("UPDATE captures SET dup_of=NULL WHERE dir=?", (os.path.abspath(d),))
+            self._db.executemany("UPDATE captures SET dup_of=? WHERE path=?",
+                                 [(rep, p) for p, rep in dup_of.items()])
+            self._db.commit()
+
+    def dup_counts(self, d: str) -> Dict[str, int]:
+        """代表图 -> 被折叠的近重复张数"""
+        with self._lock:
+            cur = self._db.execute(
+                "SELECT dup_of, COUNT(*) FROM captures WHERE dir=? AND dup_of IS NOT NULL GROUP BY dup_of",
+                (os.path.abspath(d),))
+            return dict(cur.fetchall())
+
+    def file_keys(self, d: str) -> Dict[str, Tuple[str, float, int]]:
+        """path -> (path, mtime, size)：列表缩略图的内存缓存键，取自索引，绘制时不必 stat"""
+        with self._lock:
+            cur = self._db.execute("SELECT path, mtime, size FROM captures WHERE dir=?",
+                                   (os.path.abspath(d),))
+            return {r[0]: tuple(r) for r in cur}
+
+    # ---------- 检测元数据 ----------
+    def get_detections(self, path: str) -> List[Tuple]:
+        """[(cls, cls_id, conf, (x1, y1, x2, y2))]，按置信度降序"""
+        with self._lock:
+            cur = self._db.execute(
+                "SELECT cls, cls_id, conf, x1, y1, x2, y2 FROM detections WHERE path=? ORDER BY conf DESC",
+                (os.path.abspath(path),))
+            return [(c, cid, conf, (x1, y1, x2, y2)) for c, cid, conf, x1, y1, x2, y2 in cur]
+
+    def detection_classes(self, d: str) -> List[Tuple[str, int]]:
+        """目录中出现过的类别及含该类别的截图张数（供筛选下拉框）"""
+        with self._lock:
+            cur = self._db.execute(
+                "SELECT t.cls, COUNT(DISTINCT t.path) FROM detections t JOIN captures c ON c.path=t.path "
+                "WHERE c.dir=? GROUP BY t.cls ORDER BY t.cls", (os.path.abspath(d),))
+            return list(cur)
+
+    # ---------- 查询（按时间倒序） ----------
+    @staticmethod
+    def _filters(collapse: bool, cls: Optional[str], min_conf: float, alarm_only: bool) -> Tuple[str, list]:
+        """
+        collapse：只返回近重复分组的代表图
+        cls / min_conf：存在该类别（cls 为 None 时为任意类别）且置信度 ≥ min_conf 的框
+        alarm_only：只返回截图时处于报警状态的
+        """
+        sql, params = "", []
+        if collapse:
+            sql += " AND dup_of IS NULL"
+        if alarm_only:
+            sql += " AND alarm=1"
+        if cls is not None or min_conf > 0:
+            sub = "SELECT path FROM detections WHERE conf>=?"
+            params.append(float(min_conf))
+            if cls is not None:
+                sub += " AND cls=?"
+                params.append(cls)
+            sql += f" AND path IN ({sub})"
+        return sql, params
+
+    def all_paths(self, d: str, collapse: bool = False, cls: Optional[str] = None,
+                  min_conf: float = 0.0, alarm_only: bool = False) -> List[str]:
+        extra, params = self._filters(collapse, cls, min_conf, alarm_only)
+        with self._lock:
+            cur = self._db.execute(
+                f"SELECT path FROM captures WHERE dir=?{extra} ORDER BY mtime DESC",
+                [os.path.abspath(d)] + params)
+            return [r[0] for r in cur]
+
+    def query_date(self, d: str, day: datetime.date, collapse: bool = False, cls: Optional[str] = None,
+                   min_conf: float = 0.0, alarm_only: bool = False) -> List[str]:
+        """本地时区某一天的截图：mtime ∈ [当天 0 点, 次日 0 点)，走 (dir, mtime) 索引范围查找"""
+        t0 = datetime.datetime.combine(day, datetime.time()).timestamp()
+        t1 = datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time()).timestamp()
+        extra, params = self._filters(collapse, cls, min_conf, alarm_only)
+        with self._lock:
+            cur = self._db.execute(
+                f"SELECT path FROM captures WHERE dir=? AND mtime>=? AND mtime<?{extra} ORDER BY mtime DESC",
+                [os.path.abspath(d), t0, t1] + params)
+            return [r[0] for r in cur]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_INDEXES: Dict[str, RecordingIndex] = {}
+_INDEXES_LOCK = threading.Lock()
+_CAPTURE_INDEXES: Dict[str, CaptureIndex] = {}
+
+
+def recording_index(db_path: str, video_dir: str) -> RecordingIndex:
+    """按数据库路径共享同一个索引实例（摄像头页写、视频库页读）"""
+    key = os.path.abspath(db_path)
+    with _INDEXES_LOCK:
+        idx = _INDEXES.get(key)
+        if idx is None:
+            idx = _INDEXES[key] = RecordingIndex(key, video_dir)
+        return idx
+
+
+def capture_index(db_path: str) -> CaptureIndex:
+    """按数据库路径共享同一个截图索引实例（写入方与图片页共用）"""
+    key = os.path.abspath(db_path)
+    with _INDEXES_LOCK:
+        idx = _CAPTURE_INDEXES.get(key)
+        if idx is None:
+            idx = _CAPTURE_INDEXES[key] = CaptureIndex(key)
+        return idx
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+model_manager.py
+两套检测栈（驾驶员 yolov7 / 道路场景 ultralytics YOLO）共用的检测器接口与模型管理器
+- Detector：统一接口——key（共享键）、load()、warmup()、detect(frame) -> Detections、unload()
+- ModelManager：同一 key 只加载一次；在单个后台线程里加载 + 预热（不卡 GUI 线程）；
+  页面/工作线程通过 acquire()/release() 引用计数共享；无人引用的模型按 LRU 在超出内存预算
+  或闲置超时后卸载（后台守护线程定期 trim()，闲置检查不依赖加载/释放事件）；
+  记录每个模型的加载/预热耗时，report() 汇总
+这里不导入 torch，模型体积按 parameters()/buffers() 鸭子类型估算。
+"""
+import gc
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from typing import Protocol
+except ImportError:  # Python 3.7
+    Protocol = object
+
+DEFAULT_BUDGET_MB = 1024   # 已加载模型的总内存预算：超出时卸载无人引用的模型
+DEFAULT_IDLE_SECS = 300    # 无人引用超过该时长即卸载
+TRIM_INTERVAL_SECS = 30    # 后台定期 trim() 的间隔上限（不超过 idle_secs 的 1/4）
+
+
+@dataclass
+class Detections:
+    """
+    检测结果：原图坐标的 xyxy (N,4) float32、conf (N,) float32、cls (N,) int64，names 为 {类别号: 名称}
+    timings 为本次调用的 (推理, NMS) 秒数——随结果返回，共享模型被多线程使用时也不会读到别人的耗时
+    """
+    xyxy: np.ndarray
+    conf: np.ndarray
+    cls: np.ndarray
+    names: Dict[int, str] = field(default_factory=dict)
+    timings: Tuple[float, float] = (0.0, 0.0)
+
+    def __len__(self) -> int:
+        return len(self.conf)
+
+    @classmethod
+    def empty(cls, names: Optional[Dict[int, str]] = None,
+              timings: Tuple[float, float] = (0.0, 0.0)) -> "Detections":
+        return cls(np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int64), names or {},
+                   timings)
+
+
+class Detector(Protocol):
+    """
+    检测器接口。key 相同的两个实例视为同一模型（ModelManager 只保留先注册的那一个）。
+    load() 在后台线程调用，完成后 model 可用；unload() 释放 model。
+    detect() 须自行串行化对共享 model 的前向（ultralytics / yolov7 的推理都不是线程安全的）。
+    """
+    key: Hashable
+    name: str
+    model: object
+
+    def load(self) -> None: ...
+
+    def warmup(self) -> None: ...
+
+    def detect(self, frame_bgr: np.ndarray) -> Detections: ...
+
+    def unload(self) -> None: ...
+
+
+def model_nbytes(model) -> int:
+    """估算模型占用：参数 + 缓冲区字节数；ultralytics YOLO 外壳取其 .model"""
+    inner = getattr(model, "model", None)
+    if inner is not None and hasattr(inner, "parameters") and not hasattr(model, "parameters"):
+        model = inner
+    total = 0
+    try:
+        for t in list(model.parameters()) + list(model.buffers()):
+            total += t.numel() * t.element_size()
+    except (AttributeError, TypeError):
+        pass
+    return total
+
+
+class _Entry:
+    __slots__ = ("detector", "state", "ready", "error", "refs", "last_used",
+                 "load_s", "warm_s", "nbytes", "loads")
+
+    def __init__(self, detector):
+        self.detector = detector
+        self.state = "idle"          # idle / loading / ready / failed
+        self.ready = threading.Event()
+        self.error: Optional[str] = None
+        self.refs = 0
+        self.last_used = time.monotonic()
+        self.load_s = 0.0
+        self.warm_s = 0.0
+        self.nbytes = 0
+        self.loads = 0               # 累计加载次数（卸载后再次使用会重新加载）
+
+
+class ModelManager:
+    def __init__(self, budget_mb: float = DEFAULT_BUDGET_MB, idle_secs: float = DEFAULT_IDLE_SECS):
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.idle_secs = float(idle_secs)
+        self._entries: Dict[Hashable, _Entry] = {}
+        self._lock = threading.RLock()
+        # 单线程：模型依次加载，避免两套权重同时反序列化抢 CPU/显存
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-load")
+        self._stop = threading.Event()
+        self._reaper: Optional[threading.Thread] = None
+
+    def _start_reaper(self):
+        """调用方持有锁；首次注册模型时启动定期 trim() 的守护线程"""
+        if self._reaper is None and not self._stop.is_set():
+            self._reaper = threading.Thread(target=self._reap, name="model-trim", daemon=True)
+            self._reaper.start()
+
+    def _reap(self):
+        interval = max(1.0, min(TRIM_INTERVAL_SECS, self.idle_secs / 4))
+        while not self._stop.wait(interval):
+            try:
+                self.trim()
+            except Exception as ex:  # 不能让守护线程因单次卸载出错而退出
+                print("[Models] 定期卸载出错:", repr(ex))
+
+    # ---------- 注册 / 加载 ----------
+    def _entry(self, detector) -> _Entry:
+        with self._lock:
+            e = self._entries.get(detector.key)
+            if e is None:
+                e = self._entries[detector.key] = _Entry(detector)
+                self._start_reaper()
+            return e
+
+    def _schedule(self, e: _Entry, retry: bool = True):
+        """调用方持有锁；retry=False 时不重试已失败的加载"""
+        if e.state == "idle" or (retry and e.state == "failed"):
+            e.state = "loading"
+            e.error = None
+            e.ready.clear()
+            self._pool.submit(self._load, e)
+
+    def _load(self, e: _Entry):
+        det = e.detector
+        try:
+            t = time.perf_counter()
+            det.load()
+            e.load_s = time.perf_counter() - t
+            t = time.perf_counter()
+            det.warmup()
+            e.warm_s = time.perf_counter() - t
+            e.nbytes = model_nbytes(det.model)
+            with self._lock:
+                e.state = "ready"
+                e.loads += 1
+                e.last_used = time.monotonic()
+            print(f"[Models] {det.name}: 加载 {e.load_s * 1000:.0f} ms，预热 {e.warm_s * 1000:.0f} ms，"
+                  f"{e.nbytes / 1048576:.1f} MB")
+        except Exception as ex:  # 失败留给使用方处理（get 会抛出）
+            with self._lock:
+                e.state = "failed"
+                e.error = repr(ex)
+            print(f"[Models] {det.name} 加载失败:", e.error)
+        finally:
+            e.ready.set()
+        self.trim()
+
+    def prefetch(self, detector):
+        """
+        后台加载 + 预热（已加载/加载中/已失败则什么都不做），立即返回共享实例（model 可能尚未就绪）
+        可在每帧调用：失败的模型只在 get()/acquire() 时重试
+        """
+        e = self._entry(detector)
+        with self._lock:
+            self._schedule(e, retry=False)
+        return e.detector
+
+    def ready(self, detector) -> bool:
+        with self._lock:
+            e = self._entries.get(detector.key)
+            return e is not None and e.state == "ready"
+
+    def wait(self, detector, timeout: Optional[float] = None) -> bool:
+        """等正在进行的加载结束（不触发加载、不重试失败的）；未注册返回 False，超时返回 False"""
+        with self._lock:
+            e = self._entries.get(detector.key)
+            if e is None:
+                return False
+            if e.state != "loading":
+                return True
+        return e.ready.wait(timeout)
+
+    def get(self, detector, timeout: Optional[float] = None):
+        """阻塞直到加载完成，返回共享实例；加载失败抛 RuntimeError，超时抛 TimeoutError"""
+        return self._wait(detector, timeout, ref=False)
+
+    def _wait(self, detector, timeout: Optional[float], ref: bool):
+        e = self._entry(detector)
+        while True:
+            with self._lock:
+                self._schedule(e)
+            if not e.ready.wait(timeout):
+                raise TimeoutError(f"{e.detector.name} 加载超时")
+            with self._lock:
+                if e.state == "ready":
+                    e.last_used = time.monotonic()
+                    e.refs += int(ref)  # 与就绪检查同在锁内，避免刚返回就被卸载
+                    return e.detector
+                if e.state == "failed":
+                    raise RuntimeError(f"{e.detector.name} 加载失败: {e.error}")
+            # 等待期间恰好被 trim() 卸载：重新加载
+
+    # ---------- 引用计数 ----------
+    def acquire(self, detector, timeout: Optional[float] = None):
+        """get() 并计一次引用：引用期间不会被卸载，用完调用 release()"""
+        return self._wait(detector, timeout, ref=True)
+
+    def release(self, detector):
+        with self._lock:
+            e = self._entries.get(detector.key)
+            if e is None or e.refs <= 0:
+                return
+            e.refs -= 1
+            e.last_used = time.monotonic()
+        self.trim()
+
+    # ---------- 卸载 ----------
+    def loaded_bytes(self) -> int:
+        with self._lock:
+            return sum(e.nbytes for e in self._entries.values() if e.state == "ready")
+
+    def trim(self) -> List[str]:
+        """卸载无人引用的模型：先卸闲置超时的，再按最久未用顺序卸到预算以内；返回被卸载的名称"""
+        now = time.monotonic()
+        dropped = []
+        with self._lock:
+            free = sorted((e for e in self._entries.values() if e.state == "ready" and e.refs == 0),
+                          key=lambda e: e.last_used)
+            total = sum(e.nbytes for e in self._entries.values() if e.state == "ready")
+            for e in free:
+                if total <= self.budget_bytes and now - e.last_used < self.idle_secs:
+                    continue
+                self._unload(e)
+                total -= e.nbytes
+                dropped.append(e.detector.name)
+        if dropped:
+            gc.collect()
+            torch = sys.modules.get("torch")
+            if torch is not None and torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            print("[Models] 已卸载:", ", ".join(dropped))
+        return dropped
+
+    def _unload(self, e: _Entry):
+        """调用方持有锁"""
+        try:
+            e.detector.unload()
+        except Exception as ex:
+            print(f"[Models] {e.detector.name} 卸载出错:", repr(ex))
+        e.state = "idle"
+        e.ready.clear()
+
+    def shutdown(self):
+        self._stop.set()
+        self._pool.shutdown(wait=False)
+
+    # ---------- 报告 ----------
+    def report(self) -> str:
+        lines = ["[Models] 模型状态："]
+        with self._lock:
+            for e in self._entries.values():
+                lines.append(
+                    f"  - {e.detector.name:<24s} {e.state:<8s} 加载 {e.load_s * 1000:8.1f} ms  "
+                    f"预热 {e.warm_s * 1000:8.1f} ms  {e.nbytes / 1048576:7.1f} MB  "
+                    f"引用 {e.refs}  加载次数 {e.loads}" + (f"  (失败: {e.error})" if e.error else ""))
+        lines.append(f"  = 已加载 {self.loaded_bytes() / 1048576:.1f} MB / 预算 {self.budget_bytes / 1048576:.0f} MB")
+        return "\n".join(lines)
+
+
+_MANAGER: Optional[ModelManager] = None
+_MANAGER_LOCK = threading.Lock()
+
+
+def get_model_manager() -> ModelManager:
+    """进程内共享的模型管理器（启动预加载、各页面、工作线程共用）"""
+    global _MANAGER
+    with _MANAGER_LOCK:
+        if _MANAGER is None:
+            _MANAGER = ModelManager()
+        return _MANAGER
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+paths.py
+路径工具（只依赖标准库）：只读资源路径、可写根目录
+模型层（driving_detect 等）与界面层共用，不必为取一个目录而导入整个界面模块
+"""
+import os
+import sys
+from pathlib import Path
+
+
+def is_frozen() -> bool:
+    """判断当前是否为 PyInstaller 打包环境"""
+    return hasattr(sys, "_MEIPASS")
+
+def resource_path(*relative_parts) -> str:
+    """
+    读取只读资源（图片/图标/模型等）路径：
+    - 开发期：smart_driving/ 根目录
+    - 打包后：_MEIPASS 临时目录
+    用法：resource_path('image','icons','home.png')
+    """
+    if is_frozen():
+        base = Path(getattr(sys, "_MEIPASS"))
+    else:
+        # 本文件通常位于 smart_driving/view/ 或 smart_driving/ 下
+        base = Path(__file__).resolve().parent.parent
+    return str(base.joinpath(*relative_parts))
+
+def writable_root() -> str:
+    """
+    返回可写根目录：
+    - 开发期：smart_driving/image/
+    - 打包后：系统用户目录（Windows: %APPDATA%，macOS: ~/Library/Application Support，Linux: ~/.local/share）/smart_driving
+    """
+    if is_frozen():
+        home = Path.home()
+        if sys.platform.startswith("win"):
+            base = Path(os.getenv("APPDATA", home / "AppData" / "Roaming"))
+        elif sys.platform == "darwin":
+            base = home / "Library" / "Application Support"
+        else:
+            base = home / ".local" / "share"
+        root = base / "smart_driving"
+    else:
+        root = Path(resource_path("image"))
+    root.mkdir(parents=True, exist_ok=True)
+    return str(root)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+preload.py
+启动预加载：在开机动画播放期间，于后台线程完成
+  1) 导入重型模块（view.app → torch / cv2 / ultralytics / pygame / requests / mutagen）
+  2) 把模型权重（驾驶员检测 yolov7、道路场景 yolov8）交给 ModelManager 后台加载 + 预热，
+     不阻塞 UI 启动；页面在模型就绪前跳过检测。这两个阶段只是排队，耗时近乎 0；
+     真正的加载/预热耗时由 model_report() 在模型就绪后从 ModelManager 取
+  3) 扫描音乐目录
+录像索引对账（逐个探测新录像，首次运行可能很久）不在这里做：VideoBrowserPage 创建时在后台对账。
+各阶段单独计时，done() 为 True 后由 main.py 拉起 UI。
+注意：这里只做导入/加载/扫描，不创建任何 QWidget（控件只能在 GUI 线程创建）。
+"""
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+
+class Preloader:
+    def __init__(self, phases: List[Tuple[str, Callable[[], object]]]):
+        self.phases = phases
+        self.timings: List[Tuple[str, float, Optional[str]]] = []  # (阶段, 秒, 错误)
+        self._done = threading.Event()
+        self._t0 = None
+        self.elapsed = 0.0
+
+    def start(self):
+        self._t0 = time.perf_counter()
+        threading.Thread(target=self._run, name="preload", daemon=True).start()
+
+    def _run(self):
+        try:
+            for name, fn in self.phases:
+                t = time.perf_counter()
+                err = None
+                try:
+                    fn()
+                except Exception as e:  # 单个阶段失败不影响后续阶段；真正使用时会再报错
+                    err = repr(e)
+                self.timings.append((name, time.perf_counter() - t, err))
+        finally:
+            self.elapsed = time.perf_counter() - self._t0
+            self._done.set()
+
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def report(self, extra: List[Tuple[str, float]] = ()) -> str:
+        lines = ["[Startup] 预加载阶段耗时："]
+        for name, dt, err in self.timings:
+            lines.append(f"  - {name:<14s} {dt * 1000:8.1f} ms" + (f"  (失败: {err})" if err else ""))
+        lines.append(f"  = 预加载合计     {self.elapsed * 1000:8.1f} ms")
+        for name, dt in extra:
+            lines.append(f"  * {name:<14s} {dt * 1000:8.1f} ms")
+        return "\n".join(lines)
+
+
+# ---------------------------------
+# 默认阶段（都在后台线程执行，导入放在函数内部）
+# ---------------------------------
+def _import_ui():
+    import view.app  # noqa: F401  连带导入 functions / road_scene_ultra / pygame / requests / mutagen
+    import view.load_win  # noqa: F401
+
+
+_PREFETCHED = []  # 已交给 ModelManager 后台加载的模型规格
+
+
+def _load_driver_model():
+    from view.driving_detect import driver_detector
+    from view.model_manager import get_model_manager
+    _PREFETCHED.append(get_model_manager().prefetch(driver_detector()))  # CameraPage 开摄像头时直接复用
+
+
+def _load_road_model():
+    from view.road_scene_ultra import AnalyzerConfig, RoadSceneAnalyzer
+    from view.model_manager import get_model_manager
+    _PREFETCHED.append(get_model_manager().prefetch(RoadSceneAnalyzer.detector_for(AnalyzerConfig())))
+
+
+def model_report(timeout: Optional[float] = 300.0) -> str:
+    """等预加载排队的模型加载 + 预热结束（不触发重试），返回 ModelManager 的实测耗时报告；可在工作线程调用"""
+    from view.model_manager import get_model_manager
+    mm = get_model_manager()
+    for det in list(_PREFETCHED):
+        mm.wait(det, timeout)
+    return mm.report()
+
+
+def _scan_music():
+    from view.app import scan_music_folder
+    from view.functions import resource_path
+    scan_music_folder(resource_path("music"))
+
+
+def default_phases() -> List[Tuple[str, Callable[[], object]]]:
+    return [
+        ("import modules", _import_ui),
+        ("queue driver", _load_driver_model),
+        ("queue road", _load_road_model),
+        ("music scan", _scan_music),
+    ]
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+thumb_cache.py
+缩略图磁盘缓存 + 后台线程池生成（不阻塞 GUI 线程）
+- 缓存键：绝对路径 + 文件大小 + 修改时间(ns) + 目标尺寸 + 类型标签
+- 线程里只做解码/缩放/写盘，产出 QImage；QPixmap 由 GUI 线程转换
+- 除首帧缩略图外，还可生成“悬停预览”拼图（sprite：每秒一帧横向拼成一张 JPEG）
+- PixmapLRU：GUI 线程里的内存缓存（按字节数限额）；键由调用方给出，文件缩略图应带上
+  修改时间和大小（与磁盘缓存一样），同名文件被覆盖后不会命中旧图
+"""
+import hashlib
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Hashable, Optional, Tuple
+
+import cv2
+import numpy as np
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QSize, pyqtSignal
+from PyQt5.QtGui import QImage, QImageReader, QPixmap
+
+
+# ==============================
+# 磁盘缓存
+# ==============================
+class ThumbCache:
+    """按 (path, size, mtime, 尺寸) 命名的 JPEG 缓存目录"""
+    def __init__(self, cache_dir: str, quality: int = 85):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.quality = int(quality)
+
+    def key(self, path: str, size: Tuple[int, int], tag: str = "thumb") -> Optional[str]:
+        """文件不存在时返回 None"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        raw = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}|{size[0]}x{size[1]}|{tag}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def file_for(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.jpg"
+
+    def load(self, key: str) -> Optional[QImage]:
+        f = self.file_for(key)
+        if not f.exists():
+            return None
+        img = QImage(str(f))
+        return None if img.isNull() else img
+
+    def store(self, key: str, img) -> bool:
+        """
+        原子写入（先写临时文件再 replace），并发生成同一张图也不会写坏
+        img 可以是 BGR ndarray 或 QImage
+        """
+        f = self.file_for(key)
+        f.parent.mkdir(parents=True, exist_ok=True)
+        tmp = f.with_suffix(f".{os.getpid()}.{id(img)}.tmp")
+        try:
+            if isinstance(img, QImage):
+                if not img.save(str(tmp), "JPG", self.quality):
+                    return False
+            else:
+                ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                if not ok:
+                    return False
+                tmp.write_bytes(buf.tobytes())
+            os.replace(tmp, f)
+            return True
+        except OSError:
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+            return False
+
+
+# ==============================
+# 解码工具（在工作线程里调用）
+# ==============================
+def fit_size(w: int, h: int, max_w: int, max_h: int) -> Tuple[int, int]:
+    """保持宽高比缩放到 max_w x max_h 以内"""
+    s = min(max_w / max(1, w), max_h / max(1, h))
+    return max(1, int(w * s)), max(1, int(h * s))
+
+
+def render_video_thumb(path: str, size: Tuple[int, int]):
+    """读取视频首帧并缩放，返回 BGR ndarray；失败返回 None"""
+    cap = cv2.VideoCapture(path)
+    try:
+        ok, frame = cap.read()
+    finally:
+        cap.release()
+    if not ok or frame is None:
+        return None
+    h, w = frame.shape[:2]
+    nw, nh = fit_size(w, h, *size)
+    return cv2.resize(frame, (nw, nh), interpolation=cv2.INTER_AREA)
+
+
+SPRITE_MAX_TILES = 120   # 单个拼图最多帧数（长视频自动拉大取帧间隔）
+
+
+def render_video_sprite(path: str, size: Tuple[int, int], every_s: float = 1.0):
+    """
+    悬停预览拼图：每 every_s 秒取一帧，缩放到 size（不足处补黑边）后横向拼接。
+    帧数 = 拼图宽度 // size[0]。跳过的帧只 grab() 不解码。
+    """
+    tw, th = size
+    cap = cv2.VideoCapture(path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+        frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        if frames > 0:
+            every_s = max(every_s, frames / fps / SPRITE_MAX_TILES)
+        step = max(1, int(round(every_s * fps)))
+
+        tiles, idx = [], 0
+        while len(tiles) < SPRITE_MAX_TILES:
+            if not cap.grab():
+                break
+            if idx % step == 0:
+                ok, frame = cap.retrieve()
+                if not ok or frame is None:
+                    break
+                h, w = frame.shape[:2]
+                nw, nh = fit_size(w, h, tw, th)
+                tile = np.zeros((th, tw, 3), np.uint8)
+                x0, y0 = (tw - nw) // 2, (th - nh) // 2
+                tile[y0:y0 + nh, x0:x0 + nw] = cv2.resize(frame, (nw, nh), interpolation=cv2.INTER_AREA)
+                tiles.append(tile)
+            idx += 1
+    finally:
+        cap.release()
+    return np.hstack(tiles) if tiles else None
+
+
+def render_image_thumb(path: str, size: Tuple[int, int]) -> Optional[QImage]:
+    """图片缩略图：QImageReader 按目标尺寸解码（JPEG 可直接降采样解码），自动处理 EXIF 旋转"""
+    reader = QImageReader(path)
+    reader.setAutoTransform(True)
+    src = reader.size()
+    if src.isValid():
+        nw, nh = fit_size(src.width(), src.height(), *size)
+        reader.setScaledSize(QSize(nw, nh))
+    img = reader.read()
+    return None if img.isNull() else img
+
+
+def bgr_to_qimage(bgr) -> QImage:
+    """BGR ndarray -> 独立持有内存的 QImage（可安全跨线程传递）"""
+    rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+    h, w = rgb.shape[:2]
+    return QImage(rgb.data, w, h, rgb.strides[0], QImage.Format_RGB888).copy()
+
+
+# ==============================
+# 后台生成
+# ==============================
+class _ThumbJob(QRunnable):
+    def __init__(self, loader: "ThumbLoader", path: str, generation: int):
+        super().__init__()
+        self.loader = loader
+        self.path = path
+        self.generation = generation
+
+    def run(self):
+        # 已被新的查询取代：直接丢弃，不做解码
+        if self.generation != self.loader.generation:
+            return
+        img = None
+        try:
+            img = self.loader.produce(self.path)
+        except Exception as e:
+            print("[ThumbLoader] 生成失败:", self.path, e)
+        self.loader.ready.emit(self.path, img if img is not None else QImage(), self.generation)
+
+
+class ThumbLoader(QObject):
+    """
+    缩略图加载器：request(path) 后在线程池中生成，完成后发出 ready(path, QImage, generation)
+    - 先查磁盘缓存，未命中再解码并写回缓存
+    - cancel_all() 丢弃排队中的任务（翻页/重新查询时调用）
+    """
+    ready = pyqtSignal(str, QImage, int)
+
+    def __init__(self, cache_dir: str, size: Tuple[int, int], renderer=render_video_thumb,
+                 tag: str = "thumb", max_threads: int = 0, parent=None):
+        super().__init__(parent)
+        self.cache = ThumbCache(cache_dir)
+        self.size = (int(size[0]), int(size[1]))
+        self.renderer = renderer
+        self.tag = tag
+        self.generation = 0
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads or max(2, min(4, os.cpu_count() or 2)))
+
+    def produce(self, path: str) -> Optional[QImage]:
+        key = self.cache.key(path, self.size, self.tag)
+        if key is None:
+            return None
+        img = self.cache.load(key)
+        if img is not None:
+            return img
+        img = self.renderer(path, self.size)
+        if img is None:
+            return None
+        self.cache.store(key, img)
+        return img if isinstance(img, QImage) else bgr_to_qimage(img)
+
+    def request(self, path: str, priority: int = 0):
+        self.pool.start(_ThumbJob(self, str(path), self.generation), priority)
+
+    def cancel_all(self):
+        self.generation += 1
+        self.pool.clear()
+
+    def shutdown(self, wait_ms: int = 1000):
+        self.cancel_all()
+        self.pool.waitForDone(wait_ms)
+
+
+# ==============================
+# 内存缓存（仅在 GUI 线程使用）
+# ==============================
+class PixmapLRU:
+    """按字节数限额的 QPixmap LRU：命中即移到队尾，超额时从队首淘汰"""
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = int(max_bytes)
+        self.bytes = 0
+        self._items: "OrderedDict[Hashable, QPixmap]" = OrderedDict()
+
+    @staticmethod
+    def _cost(pix: QPixmap) -> int:
+        return pix.width() * pix.height() * max(1, pix.depth() // 8)
+
+    def get(self, key: Hashable) -> Optional[QPixmap]:
+        pix = self._items.get(key)
+        if pix is not None:
+            self._items.move_to_end(key)
+        return pix
+
+    def put(self, key: Hashable, pix: QPixmap):
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.bytes -= self._cost(old)
+        self._items[key] = pix
+        self.bytes += self._cost(pix)
+        while self.bytes > self.max_bytes and len(self._items) > 1:
+            _, victim = self._items.popitem(last=False)
+            self.bytes -= self._cost(victim)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def clear(self):
+        self._items.clear()
+        self.bytes = 0